@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+n_ary on long argument lists: the old slicing right fold versus the
+iterative fold and the associative tree reduction.
+
+    python bench_deco.py -n 20000
+"""
+
+from optparse import OptionParser
+from functools import update_wrapper
+import time
+
+from deco import n_ary
+
+
+def n_ary_sliced(f):
+    '''n_ary as it was: right fold over a reversed slice copy'''
+    def _wrapper(*args):
+        res = f(args[-2], args[-1])
+        for arg in args[-3::-1]:
+            res = f(arg, res)
+        return res
+    update_wrapper(_wrapper, f)
+    return _wrapper
+
+
+def add(a, b):
+    return a + b
+
+
+def bench(name, f, args, repeat):
+    start = time.clock()
+    for _ in xrange(repeat):
+        res = f(*args)
+    print "%-30s %10.3f ms" % (name, (time.clock() - start) * 1e3 / repeat)
+    return res
+
+
+def main():
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=20000)
+    op.add_option("-r", "--repeat", action="store", type=int, default=5)
+    (opts, args) = op.parse_args()
+
+    numbers = range(opts.n)
+    strings = ["x" * 10] * opts.n
+    for kind, data in [("ints", numbers), ("strings", strings)]:
+        print "%d %s:" % (opts.n, kind)
+        results = [
+            bench("sliced fold", n_ary_sliced(add), data, opts.repeat),
+            bench("iterative fold", n_ary(add), data, opts.repeat),
+            bench("associative tree", n_ary(add, associative=True), data, opts.repeat),
+        ]
+        assert results.count(results[0]) == len(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Line parsing of log_analyzer: the hand-written UI_SHORT_REGEXP with all
+its named groups versus the same format compiled from the nginx
+log_format string (LOG_FORMAT in the config), which captures only the
+fields of the report.
+
+    python bench_log_analyzer.py -n 200000
+"""
+
+from optparse import OptionParser
+import functools
+import random
+import re
+import time
+
+import log_analyzer
+from log_analyzer import UI_SHORT_REGEXP, UI_SHORT_LOG_FORMAT, compile_log_format
+
+LINE = ('1.169.137.128 -  - [30/Jun/2017:03:28:23 +0300] '
+        '"GET /api/v2/group/%d/banners HTTP/1.1" 200 994 "-" '
+        '"Mozilla/5.0 (Windows NT 6.1; WOW64) Gecko/20100101 Firefox/54.0" "-" '
+        '"1498782502-2118016444-4707-10488733" "712e90144abee9" %.3f\n')
+BAD_LINE = ('1.202.56.176 -  - [29/Jun/2017:03:59:15 +0300]'
+            ' "0" 400 166 "-" "-" "-" "-" "-" 0.000\n')
+
+
+def make_lines(n, bad_ratio=0.01, seed=0):
+    rnd = random.Random(seed)
+    return [BAD_LINE if rnd.random() < bad_ratio
+            else LINE % (rnd.randint(1, 10 ** 6), rnd.random())
+            for _ in xrange(n)]
+
+
+def bench(name, parse, lines, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.clock()
+        res = map(parse, lines)
+        elapsed = time.clock() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print "%-30s %8.3f us/line" % (name, best * 1e6 / len(lines))
+    return res
+
+
+def main():
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=200000)
+    op.add_option("-r", "--repeat", action="store", type=int, default=3)
+    (opts, args) = op.parse_args()
+
+    lines = make_lines(opts.n)
+    start = time.clock()
+    fmt = compile_log_format(UI_SHORT_LOG_FORMAT)
+    print "log_format compiled in %.3f ms" % ((time.clock() - start) * 1e3)
+    print "%d lines:" % opts.n
+    results = [
+        bench("UI_SHORT_REGEXP", functools.partial(log_analyzer._parse_line,
+                                                   re.compile(UI_SHORT_REGEXP)),
+              lines, opts.repeat),
+        bench("compiled log_format", fmt.parse, lines, opts.repeat),
+    ]
+    assert results[0] == results[1]
+
+
+if __name__ == "__main__":
+    main()
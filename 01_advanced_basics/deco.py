@@ -1,7 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+import cPickle as pickle
+import errno
+import fcntl
 from functools import update_wrapper
+import hashlib
+import os
+from cStringIO import StringIO
+import tempfile
+import threading
+import time
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+_KWD_MARK = object()
 
 
 def disable(f):
@@ -38,37 +52,330 @@ def countcalls(f):
     return wrapper
 
 
-def memo(func):
+def _make_key(args, kwargs):
+    key = args
+    if kwargs:
+        key += (_KWD_MARK,) + tuple(sorted(kwargs.items()))
+    return key
+
+
+def memo(func=None, maxsize=None, ttl=None, key=None):
     '''
-    Memoize a function so that it caches all return values for
+    Memoize a function so that it caches return values for
     faster future lookups.
+
+    Can be used bare (@memo, unbounded) or with options:
+
+    >>> @memo(maxsize=1000, ttl=60, key=lambda user, **kw: user.id)
+
+    maxsize bounds the cache with LRU eviction, ttl (seconds) expires
+    entries, key builds the cache key from call arguments (default is
+    a tuple of args and sorted kwargs). Calls with unhashable
+    arguments are not cached. The cache is thread-safe, the function
+    itself is called outside of the lock. Exposes cache_info() and
+    cache_clear().
     '''
-    _cache = {}
-    def _pickle_args(args, kwargs):
-        return (repr(args), repr(kwargs))
+    if func is None:
+        return lambda f: memo(f, maxsize=maxsize, ttl=ttl, key=key)
+    _cache = OrderedDict()
+    _lock = threading.Lock()
+    _stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
     def _memo_func(*args, **kwargs):
-        key = _pickle_args(args, kwargs)
-        if _cache.has_key(key):
-            print "return from cache"
-            return _cache[key]
-        else:
-            res = func(*args, **kwargs)
-            _cache[key] = res
-            return res
+        k = key(*args, **kwargs) if key else _make_key(args, kwargs)
+        try:
+            with _lock:
+                if k in _cache:
+                    res, expires = _cache.pop(k)
+                    if expires is None or expires > time.time():
+                        _cache[k] = (res, expires)
+                        _stats['hits'] += 1
+                        return res
+                    _stats['evictions'] += 1
+                _stats['misses'] += 1
+        except TypeError:
+            # unhashable arguments
+            return func(*args, **kwargs)
+        res = func(*args, **kwargs)
+        with _lock:
+            _cache.pop(k, None)
+            _cache[k] = (res, time.time() + ttl if ttl is not None else None)
+            while maxsize is not None and len(_cache) > maxsize:
+                _cache.popitem(last=False)
+                _stats['evictions'] += 1
+        return res
+
+    def cache_info():
+        with _lock:
+            return CacheInfo(maxsize=maxsize, currsize=len(_cache), **_stats)
+
+    def cache_clear():
+        with _lock:
+            _cache.clear()
+            _stats.update(hits=0, misses=0, evictions=0)
+
     update_wrapper(_memo_func, func)
+    _memo_func.cache_info = cache_info
+    _memo_func.cache_clear = cache_clear
     return _memo_func
 
 
-def n_ary(f):
+@contextmanager
+def _nolock():
+    yield
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+
+class DictBackend(object):
+    '''
+    shared_memo backend over a dict-like object. To share it between
+    processes pass a Manager dict and a Manager lock:
+
+    >>> manager = multiprocessing.Manager()
+    >>> backend = DictBackend(manager.dict(), manager.Lock())
+
+    The lock only guards in-flight markers kept in the mapping: the
+    process computing a missing value marks its key, the others poll
+    for that key only, and values are computed outside the lock, so
+    different keys and recursive calls run concurrently. The marker of
+    a process that died is taken over. Without the lock processes do
+    not wait for each other.
+    '''
+    POLL_INTERVAL = 0.001
+    MAX_POLL_INTERVAL = 0.05
+
+    def __init__(self, mapping=None, lock=None):
+        self.mapping = {} if mapping is None else mapping
+        self._lock = lock
+
+    def get(self, key):
+        try:
+            return True, self.mapping[key]
+        except KeyError:
+            return False, None
+
+    def set(self, key, value):
+        self.mapping[key] = value
+
+    def lock(self, key):
+        return self._key_lock(key) if self._lock is not None else _nolock()
+
+    @contextmanager
+    def _key_lock(self, key):
+        marker = ('__inflight__', key)
+        delay = self.POLL_INTERVAL
+        while not self._claim(marker):
+            time.sleep(delay)
+            delay = min(delay * 2, self.MAX_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.mapping.pop(marker, None)
+
+    def _claim(self, marker):
+        with self._lock:
+            owner = self.mapping.get(marker)
+            if owner is not None and _alive(owner):
+                return False
+            self.mapping[marker] = os.getpid()
+            return True
+
+    def clear(self, name=None):
+        '''Drops the keys of the function name (all keys if None)'''
+        if name is None:
+            self.mapping.clear()
+            return
+        for k in self.mapping.keys():
+            if k[0] == name:
+                self.mapping.pop(k, None)
+
+
+class FileBackend(object):
+    '''
+    shared_memo backend keeping pickled values in a directory, one
+    file per key. Persists across runs and is shared by all processes
+    on the host: values are written with an atomic rename, and a
+    per-key flock makes only one process compute a missing value.
+    Files are named by the hashes of the function name and the key.
+    '''
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        try:
+            os.makedirs(self.path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def _prefix(name):
+        return hashlib.sha1(name).hexdigest()[:16] + '-'
+
+    def _fname(self, key):
+        # without the memo equal keys pickle to equal strings
+        buf = StringIO()
+        pickler = pickle.Pickler(buf, 2)
+        pickler.fast = 1
+        pickler.dump(key)
+        return os.path.join(self.path, self._prefix(key[0]) +
+                            hashlib.sha1(buf.getvalue()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._fname(key), 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if stored_key != key:
+            return False, None
+        return True, value
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, value), f, 2)
+        os.rename(tmp, self._fname(key))
+
+    @contextmanager
+    def lock(self, key):
+        with open(self._fname(key) + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def clear(self, name=None):
+        '''
+        Removes the values of the function name (all values if None).
+        Lock files are kept: other processes may hold them.
+        '''
+        prefix = self._prefix(name) if name is not None else ''
+        for fname in os.listdir(self.path):
+            if fname.startswith(prefix) and not fname.endswith(('.lock', '.tmp')):
+                try:
+                    os.remove(os.path.join(self.path, fname))
+                except OSError as exc:
+                    if exc.errno != errno.ENOENT:
+                        raise
+
+
+def shared_memo(backend=None, key=None):
+    '''
+    Memoize into a backend that may outlive the process or be shared
+    with other processes (DictBackend, FileBackend).
+
+    >>> @shared_memo(FileBackend("~/.cache/otus"))
+
+    Concurrent calls with the same key are computed once: other
+    threads wait for the one in flight, other processes wait for that
+    key through the backend (see DictBackend). Keys and values must be picklable
+    for process-shared backends; calls with unhashable arguments are
+    not cached. cache_clear() drops the values of this function only.
+    '''
+    backend = backend if backend is not None else DictBackend()
+
+    def decorator(func):
+        name = "%s.%s" % (func.__module__, func.__name__)
+        _inflight = {}
+        _lock = threading.Lock()
+
+        def _memo_func(*args, **kwargs):
+            k = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            k = (name, k)
+            try:
+                hash(k)
+            except TypeError:
+                # unhashable arguments
+                return func(*args, **kwargs)
+            found, res = backend.get(k)
+            if found:
+                return res
+            with _lock:
+                event = _inflight.get(k)
+                leader = event is None
+                if leader:
+                    event = _inflight[k] = threading.Event()
+            if not leader:
+                event.wait()
+                found, res = backend.get(k)
+                # the leader may have failed
+                return res if found else func(*args, **kwargs)
+            try:
+                with backend.lock(k):
+                    found, res = backend.get(k)
+                    if not found:
+                        res = func(*args, **kwargs)
+                        backend.set(k, res)
+                return res
+            finally:
+                with _lock:
+                    del _inflight[k]
+                event.set()
+
+        update_wrapper(_memo_func, func)
+        _memo_func.cache_clear = lambda: backend.clear(name)
+        return _memo_func
+    return decorator
+
+
+class _Pair(object):
+    '''f(*pair) for pool.map'''
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, pair):
+        return self.f(*pair)
+
+
+def n_ary(f=None, associative=False, pool=None):
     '''
     Given binary function f(x, y), return an n_ary function such
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x.
+
+    With associative=True arguments are reduced pairwise in a
+    balanced tree instead: f(f(x, y), f(z, t)). Equal aligned runs of
+    arguments then produce equal sub-calls, so a memoized f caches
+    sub-results, and each tree level may be computed by pool.map of
+    a thread pool (multiprocessing.pool.ThreadPool). Process pools are
+    not supported: f is pickled by name, and the name is bound to the
+    n_ary wrapper.
     '''
-    def _wrapper(*args):
-        res = f(args[-2], args[-1])
-        for arg in args[-3::-1]:
+    if f is None:
+        return lambda g: n_ary(g, associative=associative, pool=pool)
+
+    def _fold(*args):
+        it = reversed(args)
+        res = next(it)
+        for arg in it:
             res = f(arg, res)
         return res
+
+    def _tree(*args):
+        vals = list(args)
+        n = len(vals)
+        while n > 1:
+            half = n // 2
+            if pool is not None:
+                vals[:half] = pool.map(_Pair(f), [(vals[2 * i], vals[2 * i + 1])
+                                                  for i in xrange(half)])
+            else:
+                for i in xrange(half):
+                    vals[i] = f(vals[2 * i], vals[2 * i + 1])
+            if n % 2:
+                vals[half] = vals[n - 1]
+                half += 1
+            n = half
+        return vals[0]
+
+    _wrapper = _tree if associative else _fold
     update_wrapper(_wrapper, f)
     return _wrapper
 
@@ -109,6 +416,158 @@ class trace(object):
         update_wrapper(_traced, f)
         return _traced
 
+
+class FuncStats(object):
+    __slots__ = ('name', 'calls', 'sampled', 'wall', 'cpu',
+                 'self_wall', 'self_cpu', 'histogram')
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.sampled = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.self_wall = 0.0
+        self.self_cpu = 0.0
+        # bucket i holds calls taking [2**(i-1), 2**i) microseconds
+        self.histogram = [0] * 32
+
+
+class Profiler(object):
+    '''
+    Collects FuncStats of the functions decorated with profile.
+    While disabled a profiled call costs one attribute check.
+    CPU time is process-wide (time.clock), self time excludes
+    profiled callees only (sampled or not).
+    '''
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def register(self, name):
+        with self._lock:
+            return self.stats.setdefault(name, FuncStats(name))
+
+    def stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def record(self, stats, wall, cpu, self_wall, self_cpu):
+        bucket = min(int(wall * 1e6).bit_length(), 31)
+        with self._lock:
+            stats.sampled += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.self_wall += self_wall
+            stats.self_cpu += self_cpu
+            stats.histogram[bucket] += 1
+
+    def count(self, stats):
+        with self._lock:
+            stats.calls += 1
+            return stats.calls
+
+    def reset(self):
+        # the profiled wrappers hold their FuncStats, so reset in place
+        with self._lock:
+            for st in self.stats.values():
+                st.reset()
+
+    def export(self):
+        '''Per-function stats, times extrapolated from sampled calls'''
+        res = []
+        with self._lock:
+            for st in self.stats.values():
+                if not st.calls:
+                    continue
+                scale = float(st.calls) / st.sampled if st.sampled else 0.0
+                res.append({
+                    'name': st.name,
+                    'calls': st.calls,
+                    'sampled': st.sampled,
+                    'wall': st.wall * scale,
+                    'cpu': st.cpu * scale,
+                    'self_wall': st.self_wall * scale,
+                    'self_cpu': st.self_cpu * scale,
+                    'histogram_us': {2 ** i: n for i, n in enumerate(st.histogram) if n},
+                })
+        return res
+
+    def report(self, sort='wall', limit=None):
+        rows = sorted(self.export(), key=lambda r: r[sort], reverse=True)[:limit]
+        lines = ["%-40s %9s %9s %10s %10s %10s %10s %10s" % (
+            "function", "calls", "sampled", "wall ms", "self ms",
+            "cpu ms", "self cpu", "avg us")]
+        for r in rows:
+            lines.append("%-40s %9d %9d %10.3f %10.3f %10.3f %10.3f %10.1f" % (
+                r['name'], r['calls'], r['sampled'], r['wall'] * 1e3,
+                r['self_wall'] * 1e3, r['cpu'] * 1e3, r['self_cpu'] * 1e3,
+                r['wall'] * 1e6 / r['calls']))
+        return "\n".join(lines)
+
+
+profiler = Profiler()
+
+
+class profile(object):
+    '''Profile calls made to the function decorated.
+
+    @profile(sample=100)
+    def nginx_log_parser(...):
+        ....
+
+    >>> profiler.enabled = True
+    >>> ...
+    >>> print profiler.report(limit=10)
+
+    Every call is counted, every sample-th call is timed (wall, CPU,
+    self time and latency histogram). Calls made inside a timed call
+    are timed too, sampled or not, to subtract them from its self
+    time. Does nothing until profiler.enabled is set.
+    '''
+    def __init__(self, name=None, sample=1, profiler=profiler):
+        self._name = name
+        self._sample = max(sample, 1)
+        self._profiler = profiler
+
+    def __call__(self, f):
+        profiler = self._profiler
+        sample = self._sample
+        stats = profiler.register(self._name or "%s.%s" % (f.__module__, f.__name__))
+
+        def _profiled(*args, **kwargs):
+            if not profiler.enabled:
+                return f(*args, **kwargs)
+            sampled = not profiler.count(stats) % sample
+            stack = profiler.stack()
+            if not sampled and not stack:
+                return f(*args, **kwargs)
+            children = [0.0, 0.0]
+            stack.append(children)
+            wall0, cpu0 = time.time(), time.clock()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                wall, cpu = time.time() - wall0, time.clock() - cpu0
+                stack.pop()
+                if stack:
+                    stack[-1][0] += wall
+                    stack[-1][1] += cpu
+                if sampled:
+                    profiler.record(stats, wall, cpu, wall - children[0], cpu - children[1])
+
+        update_wrapper(_profiled, f)
+        return _profiled
+
+
 # countcalls should be the outmost decorator,
 # as others aren't aware of passing through its' ".calls" attribute
 @countcalls
@@ -138,6 +597,7 @@ def main():
     print foo(4, 3, 2)
     print foo(4, 3)
     print "foo was called", foo.calls, "times"
+    print foo.cache_info()
 
     print bar(4, 3)
     print bar(4, 3, 2)
@@ -147,6 +607,7 @@ def main():
     print fib.__doc__
     fib(3)
     print fib.calls, 'calls made'
+    print fib.cache_info()
 
 
 if __name__ == '__main__':
@@ -6,6 +6,7 @@ import argparse
 import bisect
 from collections import namedtuple, defaultdict
 from datetime import datetime
+import functools
 import gzip
 import json
 import logging
@@ -13,8 +14,14 @@ from logging import info, error, exception
 import os
 import yaml
 import re
+import struct
 
 LogRecord = namedtuple('LogRecord', ['url', 'request_time'])
+# LogRecord with the optional fields of LogFormat(..., extra=True)
+DetailedLogRecord = namedtuple('DetailedLogRecord',
+                               ['url', 'request_time', 'status', 'upstream_time'])
+# Sentinel result of a line that failed to parse, see _parse_line
+BadLine = namedtuple('BadLine', ['reason', 'line'])
 NginxLogInfo = namedtuple('NginxLogInfo', ['fpath', 'is_gz', 'date'])
 
 # log_format ui_short '$remote_addr $remote_user
@@ -37,14 +44,32 @@ UI_SHORT_REGEXP = ('(?P<remote_addr>[0-9a-fA-F.:]+) '
                    '"(?P<http_X_REQUEST_ID>[^"]+)" '
                    '"(?P<http_X_RB_USER>[^"]+)" '
                    '(?P<request_time>[0-9.]*)$')
+# The same format as nginx log_format, for LOG_FORMAT in the config
+UI_SHORT_LOG_FORMAT = ('$remote_addr $remote_user  $http_x_real_ip [$time_local] "$request" '
+                       '$status $body_bytes_sent "$http_referer" '
+                       '"$http_user_agent" "$http_x_forwarded_for" '
+                       '"$http_X_REQUEST_ID" "$http_X_RB_USER" '
+                       '$request_time')
 HTTP_GET_REGEXP = "^[A-Z]+ (\S+) HTTP/\d\.\d"
+HTTP_GET_RE = re.compile(HTTP_GET_REGEXP)
+# the most deflate can compress, bytes of output per byte of input
+DEFLATE_MAX_RATIO = 1032
 REPORT_HTML = "report.html"
 
 CONFIG = {
     "REPORT_SIZE": 1000,
     "REPORT_DIR": "./reports",
     "LOG_DIR": "./log",
-    "ERROR_RATIO": 0.0
+    "ERROR_RATIO": 0.0,
+    # "exception": raise and log a traceback per bad line,
+    # "sentinel": count bad lines by reason, see nginx_log_parser
+    "PARSER_MODE": "exception",
+    # bad lines logged per reason in the "sentinel" mode
+    "ERROR_LOG_LIMIT": 10,
+    # nginx log_format of the logs, UI_SHORT_REGEXP is used if not set
+    "LOG_FORMAT": None,
+    # also parse $status and $upstream_response_time of LOG_FORMAT
+    "LOG_FORMAT_EXTRA": False,
 }
 
 
@@ -119,7 +144,7 @@ def _open(fpath, is_gz):
 
 
 def _extract_url_from_request(request):
-    m = re.match(HTTP_GET_REGEXP, request)
+    m = HTTP_GET_RE.match(request)
     if not m:
         raise RuntimeError("Failed to get url from request: ", request)
     return m.group(1)
@@ -136,7 +161,174 @@ def _parse_single_line(record_regexp, line):
     )
 
 
-def nginx_log_parser(fpath, is_gz, error_ratio):
+def _parse_line(record_regexp, line):
+    """
+    Like _parse_single_line, but returns BadLine(reason, line) instead
+    of raising for a malformed line
+    """
+    res = record_regexp.match(line)
+    if not res:
+        return BadLine('format', line)
+    m = HTTP_GET_RE.match(res.group('request'))
+    if not m:
+        return BadLine('request', line)
+    try:
+        request_time = float(res.group('request_time'))
+    except ValueError:
+        return BadLine('request_time', line)
+    return LogRecord(url=m.group(1), request_time=request_time)
+
+
+class LogFormat(object):
+    """
+    Parser of the lines of an nginx log_format: the format is compiled
+    into a regexp with groups only for the fields of the report
+    ($request, $request_time and, with extra=True, $status and
+    $upstream_response_time); other variables are matched without
+    capturing. Use compile_log_format() to get a cached instance.
+    """
+    VARIABLE_RE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+    FIELDS = ('request', 'request_time')
+    EXTRA_FIELDS = ('status', 'upstream_response_time')
+    # variables whose values may contain the character after them, e.g.
+    # "0.5, 0.9" or "0.5 : 0.9" of several upstreams followed by a space
+    VARIABLE_PATTERNS = {
+        'status': r'\d{3}',
+        'upstream_response_time': r'[-0-9., :]+',
+    }
+
+    def __init__(self, log_format, extra=False):
+        self.log_format = log_format
+        self.extra = extra
+        self.fields = self.FIELDS + (self.EXTRA_FIELDS if extra else ())
+        self.regexp = re.compile(self._pattern(log_format, self.fields))
+        missing = [f for f in self.fields if f not in self.regexp.groupindex]
+        if missing:
+            raise ValueError("log_format has no $%s" % ", $".join(missing))
+        self._groups = [self.regexp.groupindex[f] for f in self.fields]
+        self.parse = self._parser()
+
+    @classmethod
+    def _pattern(cls, log_format, fields):
+        parts = []
+        captured = set()
+        pos = 0
+        tokens = list(cls.VARIABLE_RE.finditer(log_format))
+        for i, m in enumerate(tokens):
+            # nginx writes the text between variables as is
+            parts.append(re.escape(log_format[pos:m.start()]))
+            name = m.group(1) or m.group(2)
+            end = tokens[i + 1].start() if i + 1 < len(tokens) else len(log_format)
+            following = log_format[m.end():end]
+            # a variable runs up to the first character of the next literal
+            if name in cls.VARIABLE_PATTERNS:
+                value = cls.VARIABLE_PATTERNS[name]
+            elif following:
+                value = '[^%s]*' % re.escape(following[0])
+            elif end < len(log_format):
+                value = '.*?'
+            else:
+                value = '.*'
+            if name in fields and name not in captured:
+                captured.add(name)
+                value = '(?P<%s>%s)' % (name, value)
+            parts.append(value)
+            pos = m.end()
+        parts.append(re.escape(log_format[pos:]))
+        return ''.join(parts) + '$'
+
+    def _parser(self):
+        """
+        parse(line) -> LogRecord (DetailedLogRecord with extra=True) or
+        BadLine; everything it needs is bound as locals of the closure
+        """
+        match = self.regexp.match
+        get_match = HTTP_GET_RE.match
+        request, request_time = self._groups[:2]
+
+        def parse(line):
+            m = match(line)
+            if m is None:
+                return BadLine('format', line)
+            value, t = m.group(request, request_time)
+            url = get_match(value)
+            if url is None:
+                return BadLine('request', line)
+            try:
+                t = float(t)
+            except ValueError:
+                return BadLine('request_time', line)
+            return LogRecord(url.group(1), t)
+
+        if not self.extra:
+            return parse
+        status, upstream_time = self._groups[2:]
+
+        def parse_extra(line):
+            m = match(line)
+            if m is None:
+                return BadLine('format', line)
+            value, t, code, upstream = m.group(request, request_time, status, upstream_time)
+            url = get_match(value)
+            if url is None:
+                return BadLine('request', line)
+            try:
+                t = float(t)
+            except ValueError:
+                return BadLine('request_time', line)
+            try:
+                return DetailedLogRecord(url.group(1), t, int(code), _upstream_time(upstream))
+            except ValueError:
+                return BadLine('extra', line)
+
+        return parse_extra
+
+
+def _upstream_time(value):
+    """
+    $upstream_response_time: "-", a time or the times of several
+    upstreams ("0.5, 0.9", "0.5 : 0.9" after an internal redirect)
+    """
+    times = [float(t) for t in re.split('[,:]', value) if t.strip() != '-']
+    return sum(times) if times else None
+
+
+_LOG_FORMATS = {}
+
+
+def compile_log_format(log_format, extra=False):
+    key = (log_format, extra)
+    if key not in _LOG_FORMATS:
+        _LOG_FORMATS[key] = LogFormat(log_format, extra)
+    return _LOG_FORMATS[key]
+
+
+def nginx_log_parser(fpath, is_gz, error_ratio, mode='exception',
+                     errors=None, log_limit=10, log_format=None,
+                     log_format_extra=False):
+    """
+    LogRecords of the log lines. More than error_ratio of bad lines
+    raises RuntimeError. Lines are parsed with UI_SHORT_REGEXP or, if
+    given, the nginx log_format (see LogFormat); log_format_extra gives
+    DetailedLogRecords with the status and the upstream time.
+
+    mode="exception" logs every bad line with a traceback.
+    mode="sentinel" counts bad lines by reason in the errors dict (if
+    given) and logs only the first log_limit lines of each reason. It
+    stops early only once the limit is certainly exceeded: at the first
+    bad line if error_ratio is 0, or when the bad lines exceed error_ratio
+    of an upper bound of the line count, the lines read plus the bytes
+    left (see _log_size).
+    """
+    fmt = compile_log_format(log_format, log_format_extra) if log_format else None
+    if mode == 'sentinel':
+        return _nginx_log_parser_sentinel(fpath, is_gz, error_ratio, errors, log_limit, fmt)
+    if mode != 'exception':
+        raise ValueError("Unknown parser mode: %s" % mode)
+    return _nginx_log_parser_exception(fpath, is_gz, error_ratio, fmt)
+
+
+def _nginx_log_parser_exception(fpath, is_gz, error_ratio, fmt=None):
     record_regexp = re.compile(UI_SHORT_REGEXP)
     error_cnt = 0
     cnt = 0
@@ -144,14 +336,76 @@ def nginx_log_parser(fpath, is_gz, error_ratio):
         for line in f_obj:
             cnt += 1
             try:
-                yield _parse_single_line(record_regexp, line)
+                if fmt:
+                    rec = _raise_bad_line(fmt.parse(line))
+                else:
+                    rec = _parse_single_line(record_regexp, line)
             except RuntimeError as exc:
                 exception(exc)
                 error_cnt += 1
+                continue
+            yield rec
     if error_cnt > error_ratio * cnt:
         raise RuntimeError("Error ratio limit exceeded: ", error_cnt)
 
 
+def _raise_bad_line(rec):
+    if type(rec) is BadLine:
+        raise RuntimeError("Failed to parse line (%s): " % rec.reason, rec.line)
+    return rec
+
+
+def _log_size(fpath, is_gz):
+    """
+    Size of the (uncompressed) log in bytes, or None if it isn't known
+    before reading. For gzip it's ISIZE of the trailer, the size modulo
+    2**32 of the last member, trusted only if the file is too small to
+    inflate to 4GB.
+    """
+    size = os.path.getsize(fpath)
+    if not is_gz:
+        return size
+    if size < 4 or size * DEFLATE_MAX_RATIO >= 2 ** 32:
+        return None
+    with open(fpath, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0]
+
+
+def _nginx_log_parser_sentinel(fpath, is_gz, error_ratio, errors, log_limit, fmt=None):
+    if fmt:
+        parse = fmt.parse
+    else:
+        parse = functools.partial(_parse_line, re.compile(UI_SHORT_REGEXP))
+    errors = errors if errors is not None else {}
+    size = _log_size(fpath, is_gz) if error_ratio else None
+    error_cnt = 0
+    cnt = 0
+    # bytes read; file.tell() is ahead of the lines because of read-ahead
+    nbytes = 0
+    with _open(fpath, is_gz) as f_obj:
+        for line in f_obj:
+            cnt += 1
+            nbytes += len(line)
+            rec = parse(line)
+            if type(rec) is not BadLine:
+                yield rec
+                continue
+            error_cnt += 1
+            errors[rec.reason] = errors.get(rec.reason, 0) + 1
+            if errors[rec.reason] <= log_limit:
+                error("Failed to parse line (%s): %r", rec.reason, line)
+            # every line left has at least one byte
+            if not error_ratio or (size is not None and nbytes <= size and
+                                   error_cnt > error_ratio * (cnt + size - nbytes)):
+                raise RuntimeError("Error ratio limit exceeded after %d lines: " % cnt,
+                                   error_cnt, dict(errors))
+    if error_cnt > error_ratio * cnt:
+        raise RuntimeError("Error ratio limit exceeded: ", error_cnt, dict(errors))
+    if error_cnt:
+        info("Bad lines: %d of %d, %s", error_cnt, cnt, dict(errors))
+
+
 def _collect_stats(records, report_size):
     time_list = defaultdict(lambda: array('d'))
     for rec in records:
@@ -228,7 +482,11 @@ def main():
         info("Log is already parsed: %s", fpath)
         return
 
-    it = nginx_log_parser(fpath, is_gz, config['ERROR_RATIO'])
+    it = nginx_log_parser(fpath, is_gz, config['ERROR_RATIO'],
+                          mode=config['PARSER_MODE'],
+                          log_limit=config['ERROR_LOG_LIMIT'],
+                          log_format=config['LOG_FORMAT'],
+                          log_format_extra=config['LOG_FORMAT_EXTRA'])
     stats = _collect_stats(it, config['REPORT_SIZE'])
     create_report_html(REPORT_HTML, target_path, stats)
 
@@ -103,7 +103,7 @@ def best_hand(hand):
     return max(itertools.combinations(hand, 5),
                key=lambda h: hand_rank(h))
 
-RANKS = [str(i) for i in range(5, 10)] + ['T','J','Q','K','A']
+RANKS = [str(i) for i in range(2, 10)] + ['T','J','Q','K','A']
 
 
 def _expand_joker(hand, joker, joker_suits):
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Оценка эквити методом Монте-Карло на NumPy.
+#
+# Карты - индексы 0..51 (rank * 4 + suit), как в poker_eval.
+# evaluate7_np оценивает сразу массив "рук" формы (N, 7) по тем же
+# таблицам, что и poker_eval.evaluate7. equity раздаёт недостающие
+# карты борда и карты соперников пачками по batch_size и может
+# распределять пачки по процессам: у каждой пачки свой seed,
+# выведенный из общего, поэтому результат не зависит от числа процессов.
+# -----------------
+
+from collections import namedtuple
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+import poker_eval
+
+EquityResult = namedtuple('EquityResult', ['equity', 'win', 'tie', 'trials', 'ci_low', 'ci_high'])
+
+_NP_TABLES = {}
+
+
+def _tables():
+    if not _NP_TABLES:
+        if not poker_eval._RANK7:
+            poker_eval._build_tables7()
+        keys = np.array(sorted(poker_eval._RANK7), dtype=np.int64)
+        _NP_TABLES.update(
+            rank7_keys=keys,
+            rank7_vals=np.array([poker_eval._RANK7[k] for k in keys], dtype=np.int32),
+            flush7=np.array(poker_eval._FLUSH7, dtype=np.int32),
+            rank_key=np.array(poker_eval._RANK_KEY, dtype=np.int64),
+            rank_bit=np.array(poker_eval._RANK_BIT, dtype=np.int32),
+        )
+    return _NP_TABLES
+
+
+def evaluate7_np(cards):
+    """Ранги (как у poker_eval.evaluate7) для массива индексов карт формы (N, 7)"""
+    t = _tables()
+    cards = np.asarray(cards)
+    suits = cards & 3
+    counts = np.stack([(suits == s).sum(axis=1) for s in xrange(4)], axis=1)
+    flush_suit = counts.argmax(axis=1)
+    is_flush = counts.max(axis=1) >= 5
+
+    rank_keys = t['rank_key'][cards].sum(axis=1)
+    idx = np.searchsorted(t['rank7_keys'], rank_keys)
+    res = t['rank7_vals'][np.minimum(idx, len(t['rank7_keys']) - 1)]
+    if is_flush.any():
+        fc = cards[is_flush]
+        in_suit = (fc & 3) == flush_suit[is_flush][:, np.newaxis]
+        masks = np.where(in_suit, t['rank_bit'][fc], 0).sum(axis=1)
+        res[is_flush] = t['flush7'][masks]
+    return res
+
+
+def _deal(rng, deck, ncards, trials):
+    """trials раздач по ncards карт без повторов из deck"""
+    order = rng.random_sample((trials, len(deck))).argsort(axis=1)[:, :ncards]
+    return deck[order]
+
+
+def _simulate(args):
+    """Пачка раздач; возвращает (сумма долей банка, сумма квадратов, побед, ничьих, раздач)"""
+    hero, board, nopponents, trials, seed = args
+    rng = np.random.RandomState(seed)
+    known = set(hero) | set(board)
+    deck = np.array([c for c in xrange(52) if c not in known], dtype=np.int8)
+    nboard = 5 - len(board)
+    dealt = _deal(rng, deck, nboard + 2 * nopponents, trials)
+
+    full_board = np.hstack([np.tile(np.array(board, dtype=np.int8), (trials, 1)), dealt[:, :nboard]])
+    hero_rank = evaluate7_np(np.hstack([np.tile(np.array(hero, dtype=np.int8), (trials, 1)), full_board]))
+    opp_ranks = np.stack([
+        evaluate7_np(np.hstack([dealt[:, nboard + 2 * i:nboard + 2 * i + 2], full_board]))
+        for i in xrange(nopponents)
+    ], axis=1)
+
+    best_opp = opp_ranks.max(axis=1)
+    win = hero_rank > best_opp
+    tie = hero_rank == best_opp
+    nties = (opp_ranks == best_opp[:, np.newaxis]).sum(axis=1)
+    share = np.where(win, 1.0, np.where(tie, 1.0 / (nties + 1), 0.0))
+    return share.sum(), (share * share).sum(), int(win.sum()), int(tie.sum()), trials
+
+
+def _cards(cards):
+    return [c if isinstance(c, int) else poker_eval.card_index(c) for c in cards]
+
+
+def equity(hero, board=(), nopponents=1, trials=100000, batch_size=10000,
+           processes=1, seed=None, z=1.96):
+    """
+    Эквити "руки" hero (2 карты) против nopponents случайных рук
+    при известной части борда board (0..5 карт).
+    z задаёт ширину доверительного интервала (1.96 ~ 95%).
+    """
+    hero, board = _cards(hero), _cards(board)
+    if len(hero) != 2 or len(board) > 5 or len(set(hero + board)) != len(hero + board):
+        raise ValueError("Need 2 distinct hero cards and up to 5 board cards")
+    if 2 + len(board) + 2 * nopponents + (5 - len(board)) > 52:
+        raise ValueError("Not enough cards for %d opponents" % nopponents)
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    seeds = np.random.RandomState(seed).randint(2 ** 31, size=(trials + batch_size - 1) // batch_size)
+    jobs = [(hero, board, nopponents, min(batch_size, trials - i * batch_size), s)
+            for i, s in enumerate(seeds)]
+
+    _tables()
+    if processes > 1:
+        pool = mp.Pool(processes)
+        try:
+            results = pool.map(_simulate, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_simulate, jobs)
+
+    total, total_sq, wins, ties, n = [sum(r[i] for r in results) for i in xrange(5)]
+    mean = total / n
+    stderr = np.sqrt(max(total_sq / n - mean * mean, 0.0) / n)
+    return EquityResult(equity=mean, win=float(wins) / n, tie=float(ties) / n, trials=n,
+                        ci_low=mean - z * stderr, ci_high=mean + z * stderr)
+
+
+def test_evaluate7_np():
+    print "test_evaluate7_np..."
+    rng = np.random.RandomState(34)
+    cards = np.array([rng.permutation(52)[:7] for _ in xrange(20000)], dtype=np.int8)
+    expected = poker_eval.evaluate7_many(cards.ravel().tolist())
+    assert (evaluate7_np(cards) == np.array(expected)).all()
+    print 'OK'
+
+
+def test_equity():
+    print "test_equity..."
+    res = equity("AS AH".split(), nopponents=1, trials=20000, seed=1)
+    assert res.ci_low < 0.852 < res.ci_high, res
+    res = equity("AS KS".split(), "QS JS TS".split(), nopponents=3, trials=1000, seed=1)
+    assert res.equity == 1.0 and res.win == 1.0
+    assert (equity("7C 2D".split(), nopponents=2, trials=30000, seed=5, batch_size=5000)
+            == equity("7C 2D".split(), nopponents=2, trials=30000, seed=5, batch_size=5000,
+                      processes=3))
+    print 'OK'
+
+
+def bench_equity(trials=200000):
+    for processes in (1, 2, 4):
+        start = time.time()
+        res = equity("AS KD".split(), "QH 7C 2S".split(), nopponents=3,
+                     trials=trials, seed=0, processes=processes)
+        elapsed = time.time() - start
+        print "%d processes: %8.0f deals/sec, equity %.4f [%.4f, %.4f]" % (
+            processes, trials / elapsed, res.equity, res.ci_low, res.ci_high)
+
+
+if __name__ == '__main__':
+    test_evaluate7_np()
+    test_equity()
+    bench_equity()
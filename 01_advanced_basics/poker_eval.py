@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Быстрая оценка "руки" из 5ти карт на таблицах (в духе Cactus Kev).
+#
+# Карта кодируется целым числом:
+#   +--------+--------+--------+--------+
+#   |xxxbbbbb|bbbbbbbb|cdhsrrrr|xxpppppp|
+#   +--------+--------+--------+--------+
+#   p - простое число ранга (2 -> 2, 3 -> 3, ..., A -> 41)
+#   r - ранг 0..12 (2..A)
+#   cdhs - бит масти
+#   b - бит ранга
+#
+# Таблицы строятся при импорте из poker.hand_rank, поэтому
+# fast_hand_rank(h) упорядочивает руки ровно так же, как hand_rank:
+# HAND_RANKS[fast_hand_rank(h)] == hand_rank(h).
+#
+# "Рука" из 7ми карт оценивается напрямую по гистограмме рангов и
+# маскам мастей, без перебора 21 комбинации (best_hand7). Для массовой
+# оценки карты кодируются индексами 0..51 (rank * 4 + suit) и
+# передаются плоским массивом по 7 штук (evaluate7_many).
+#
+# best_wild_hand перебирает только различимые замены джокеров: масть
+# замены важна лишь когда с ней достижим флеш, иначе достаточно одной
+# масти на ранг. Каждая замена оценивается по таблицам evaluate7.
+# -----------------
+
+from array import array
+from collections import defaultdict
+import itertools
+import random
+import time
+
+import poker
+
+RANK_CHARS = "23456789TJQKA"
+SUIT_CHARS = "CDHS"
+PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+
+
+def encode_card(card):
+    """Кодирует карту вида 'AS' целым числом"""
+    r = RANK_CHARS.index(card[0])
+    s = SUIT_CHARS.index(card[1])
+    return (1 << (16 + r)) | (1 << (12 + s)) | (r << 8) | PRIMES[r]
+
+
+CARD_INTS = {r + s: encode_card(r + s) for r in RANK_CHARS for s in SUIT_CHARS}
+
+
+def _rank_tuple(ranks, is_flush):
+    suits = "C" * 5 if is_flush else "CDHSC"
+    return poker.hand_rank([RANK_CHARS[r] + s for r, s in zip(ranks, suits)])
+
+
+def _freeze(rank):
+    return tuple(tuple(x) if isinstance(x, list) else x for x in rank)
+
+
+def _build_tables():
+    distinct = list(itertools.combinations(range(13), 5))
+    multisets = [rs for rs in itertools.combinations_with_replacement(range(13), 5)
+                 if len(set(rs)) < 5 and max(rs.count(r) for r in rs) <= 4]
+    flushes = {}
+    unique5 = {}
+    products = {}
+    for rs in distinct:
+        bits = sum(1 << r for r in rs)
+        flushes[bits] = _rank_tuple(rs, True)
+        unique5[bits] = _rank_tuple(rs, False)
+    for rs in multisets:
+        product = reduce(lambda a, b: a * b, [PRIMES[r] for r in rs])
+        products[product] = _rank_tuple(rs, False)
+
+    originals = {}
+    for t in itertools.chain(flushes.values(), unique5.values(), products.values()):
+        originals[_freeze(t)] = t
+    frozen = sorted(originals)
+    hand_ranks = [originals[f] for f in frozen]
+    index = {f: i for i, f in enumerate(frozen)}
+    flush_table = [-1] * 8192
+    unique5_table = [-1] * 8192
+    for bits, t in flushes.items():
+        flush_table[bits] = index[_freeze(t)]
+    for bits, t in unique5.items():
+        unique5_table[bits] = index[_freeze(t)]
+    product_table = {p: index[_freeze(t)] for p, t in products.items()}
+    return hand_ranks, flush_table, unique5_table, product_table
+
+
+HAND_RANKS, FLUSHES, UNIQUE5, PRODUCTS = _build_tables()
+
+
+def evaluate5(c1, c2, c3, c4, c5):
+    """Ранг 5ти закодированных карт: целое 0..len(HAND_RANKS)-1, больше - лучше"""
+    q = (c1 | c2 | c3 | c4 | c5) >> 16
+    if c1 & c2 & c3 & c4 & c5 & 0xF000:
+        return FLUSHES[q]
+    r = UNIQUE5[q]
+    if r >= 0:
+        return r
+    return PRODUCTS[(c1 & 0xFF) * (c2 & 0xFF) * (c3 & 0xFF) * (c4 & 0xFF) * (c5 & 0xFF)]
+
+
+def fast_hand_rank(hand):
+    """Аналог poker.hand_rank, возвращает целое вместо кортежа"""
+    c1, c2, c3, c4, c5 = [CARD_INTS[c] for c in hand]
+    return evaluate5(c1, c2, c3, c4, c5)
+
+
+def _straight_top(mask):
+    """Старший ранг стрита в 13-битной маске рангов или None (A-5 не стрит)"""
+    for top in xrange(12, 3, -1):
+        run = 0x1F << (top - 4)
+        if mask & run == run:
+            return top
+    return None
+
+
+def _top_cards(groups, n):
+    """n старших карт из групп [(rank, [cards]), ...]"""
+    cards = sorted((c for r, cs in groups for c in cs),
+                   key=lambda c: RANK_CHARS.index(c[0]), reverse=True)
+    return cards[:n]
+
+
+def best_hand7(hand):
+    """Лучшая "рука" из 5ти карт (как poker.best_hand) за один проход
+    по гистограмме рангов и маскам мастей"""
+    by_rank = defaultdict(list)
+    by_suit = defaultdict(list)
+    for c in hand:
+        by_rank[RANK_CHARS.index(c[0])].append(c)
+        by_suit[c[1]].append(c)
+
+    for suited in by_suit.values():
+        if len(suited) >= 5:
+            # флеш исключает каре и фулл-хаус: лучше может быть только стрит-флеш
+            ranks = {RANK_CHARS.index(c[0]): c for c in suited}
+            top = _straight_top(sum(1 << r for r in ranks))
+            if top is not None:
+                return [ranks[r] for r in xrange(top, top - 5, -1)]
+            return sorted(suited, key=lambda c: RANK_CHARS.index(c[0]), reverse=True)[:5]
+
+    groups = sorted(by_rank.items(), key=lambda (r, cs): (len(cs), r), reverse=True)
+    (r1, g1), rest = groups[0], groups[1:]
+    if len(g1) == 4:
+        return g1 + _top_cards(rest, 1)
+    if len(g1) == 3 and rest and len(rest[0][1]) >= 2:
+        pair = max(r for r, cs in rest if len(cs) >= 2)
+        return g1 + by_rank[pair][:2]
+    top = _straight_top(sum(1 << r for r in by_rank))
+    if top is not None:
+        return [by_rank[r][0] for r in xrange(top, top - 5, -1)]
+    if len(g1) == 3:
+        return g1 + _top_cards(rest, 2)
+    if len(g1) == 2 and len(rest[0][1]) == 2:
+        return g1 + rest[0][1] + _top_cards(rest[1:], 1)
+    if len(g1) == 2:
+        return g1 + _top_cards(rest, 3)
+    return _top_cards(groups, 5)
+
+
+def card_index(card):
+    """Индекс карты 0..51 для evaluate7_many"""
+    return RANK_CHARS.index(card[0]) * 4 + SUIT_CHARS.index(card[1])
+
+
+def encode_hands(hands):
+    """Плоский массив индексов карт из списка "рук" по 7 карт"""
+    return array('B', [card_index(c) for h in hands for c in h])
+
+
+INDEX_CARDS = [RANK_CHARS[i // 4] + SUIT_CHARS[i % 4] for i in xrange(52)]
+_RANK_KEY = [1 << (3 * (i // 4)) for i in xrange(52)]
+_SUIT_KEY = [1 << (4 * (i % 4)) for i in xrange(52)]
+_RANK_BIT = [1 << (i // 4) for i in xrange(52)]
+_FLUSH7 = [-1] * 8192
+_RANK7 = {}
+
+
+def _build_tables7():
+    for mask in xrange(8192):
+        ranks = [r for r in xrange(13) if mask >> r & 1]
+        if len(ranks) >= 5:
+            _FLUSH7[mask] = fast_hand_rank(best_hand7([RANK_CHARS[r] + "C" for r in ranks]))
+    for rs in itertools.combinations_with_replacement(range(13), 7):
+        if max(rs.count(r) for r in rs) > 4:
+            continue
+        # копии одного ранга идут подряд, так что масти различны и флеша нет
+        hand = [RANK_CHARS[r] + SUIT_CHARS[i % 4] for i, r in enumerate(rs)]
+        _RANK7[sum(1 << (3 * r) for r in rs)] = fast_hand_rank(best_hand7(hand))
+
+
+def evaluate7(h):
+    """Ранг лучшей "руки" из 7ми индексов карт, таблицы уже построены"""
+    suits = 0
+    for c in h:
+        suits += _SUIT_KEY[c]
+    # полубайт масти >= 5 <=> флеш
+    flush = (suits + 0x3333) & 0x8888
+    if flush:
+        suit = (flush.bit_length() - 4) // 4
+        mask = 0
+        for c in h:
+            if c & 3 == suit:
+                mask |= _RANK_BIT[c]
+        return _FLUSH7[mask]
+    key = 0
+    for c in h:
+        key += _RANK_KEY[c]
+    return _RANK7[key]
+
+
+def evaluate7_many(cards):
+    """
+    Ранги (как у fast_hand_rank) лучших "рук" для плоской
+    последовательности индексов карт, по 7 на "руку".
+    Таблицы строятся при первом вызове.
+    """
+    if not _RANK7:
+        _build_tables7()
+    res = array('H', [0]) * (len(cards) // 7)
+    for n, i in enumerate(xrange(0, len(cards) - 6, 7)):
+        res[n] = evaluate7(cards[i:i + 7])
+    return res
+
+
+JOKER_SUITS = {'?B': 'CS', '?R': 'HD'}
+
+
+def _joker_substitutions(real, jokers):
+    """Различимые замены для каждого джокера, от старших рангов к младшим"""
+    suit_counts = defaultdict(int)
+    for c in real:
+        suit_counts[c[1]] += 1
+    taken = set(real)
+    res = []
+    for joker in jokers:
+        suits = JOKER_SUITS[joker]
+        flushable = [s for s in suits
+                     if suit_counts[s] + sum(s in JOKER_SUITS[j] for j in jokers) >= 5]
+        others = [s for s in suits if s not in flushable]
+        subs = []
+        for r in reversed(RANK_CHARS):
+            subs.extend(r + s for s in flushable if r + s not in taken)
+            free = [r + s for s in others if r + s not in taken]
+            subs.extend(free[:1])
+        res.append(subs)
+    return res
+
+
+def best_wild_hand(hand):
+    """poker.best_wild_hand без полного перебора замен джокеров"""
+    real = [c for c in hand if c not in JOKER_SUITS]
+    jokers = [c for c in hand if c in JOKER_SUITS]
+    if not jokers:
+        return best_hand7(hand)
+    if len(hand) == 7:
+        if not _RANK7:
+            _build_tables7()
+        evaluate = lambda h: evaluate7([card_index(c) for c in h])
+    else:
+        evaluate = lambda h: fast_hand_rank(best_hand7(h))
+    top = len(HAND_RANKS) - 1
+    best, best_rank = None, -1
+    for subs in itertools.product(*_joker_substitutions(real, jokers)):
+        h = real + list(subs)
+        rank = evaluate(h)
+        if rank > best_rank:
+            best, best_rank = h, rank
+            if rank == top:
+                break
+    return best_hand7(best)
+
+
+def test_fast_hand_rank():
+    print "test_fast_hand_rank..."
+    deck = sorted(CARD_INTS)
+    rnd = random.Random(42)
+    for _ in xrange(20000):
+        hand = rnd.sample(deck, 5)
+        assert HAND_RANKS[fast_hand_rank(hand)] == poker.hand_rank(hand)
+    assert fast_hand_rank("6C 7C 8C 9C TC".split()) > fast_hand_rank("7C 7D 7H 7S JD".split())
+    print 'OK'
+
+
+def test_best_hand7():
+    print "test_best_hand7..."
+    deck = sorted(CARD_INTS)
+    rnd = random.Random(7)
+    hands = [rnd.sample(deck, 7) for _ in xrange(3000)]
+    hands.append("6C 7C 8C 9C TC 5C JS".split())
+    hands.append("AC 2C 3C 4C 5D 9H 9S".split())
+    ranks = evaluate7_many(encode_hands(hands))
+    for hand, rank in zip(hands, ranks):
+        best = best_hand7(hand)
+        assert len(set(best)) == 5 and set(best) <= set(hand)
+        assert fast_hand_rank(best) == fast_hand_rank(poker.best_hand(hand)) == rank
+    assert (sorted(best_hand7("TD TC TH 7C 7D 8C 8S".split()))
+            == ['8C', '8S', 'TC', 'TD', 'TH'])
+    print 'OK'
+
+
+def test_best_wild_hand():
+    print "test_best_wild_hand..."
+    assert (sorted(best_wild_hand("6C 7C 8C 9C TC 5C ?B".split()))
+            == ['7C', '8C', '9C', 'JC', 'TC'])
+    assert (sorted(best_wild_hand("TD TC 5H 5C 7C ?R ?B".split()))
+            == ['7C', 'TC', 'TD', 'TH', 'TS'])
+    assert (sorted(best_wild_hand("JD TC TH 7C 7D 7S 7H".split()))
+            == ['7C', '7D', '7H', '7S', 'JD'])
+    deck = sorted(CARD_INTS)
+    rnd = random.Random(33)
+    for njokers in (1, 2):
+        for _ in xrange(10):
+            hand = rnd.sample(deck, 7 - njokers) + rnd.sample(sorted(JOKER_SUITS), njokers)
+            assert (fast_hand_rank(best_wild_hand(hand))
+                    == fast_hand_rank(poker.best_wild_hand(hand)))
+    print 'OK'
+
+
+def bench_hand_rank(nhands=100000):
+    deck = sorted(CARD_INTS)
+    rnd = random.Random(0)
+    hands = [rnd.sample(deck, 5) for _ in xrange(nhands)]
+    encoded = [[CARD_INTS[c] for c in h] for h in hands]
+    for name, f, data in [("poker.hand_rank", poker.hand_rank, hands),
+                          ("fast_hand_rank", fast_hand_rank, hands),
+                          ("evaluate5", lambda h: evaluate5(*h), encoded)]:
+        start = time.clock()
+        for h in data:
+            f(h)
+        elapsed = time.clock() - start
+        print "%-20s %10.0f hands/sec" % (name, nhands / elapsed)
+
+
+def bench_best_hand(nhands=5000):
+    deck = sorted(CARD_INTS)
+    rnd = random.Random(0)
+    hands = [rnd.sample(deck, 7) for _ in xrange(nhands)]
+    encoded = encode_hands(hands)
+    evaluate7_many(encoded[:7])
+    for name, f, data in [("poker.best_hand", lambda hs: map(poker.best_hand, hs), hands),
+                          ("best_hand7", lambda hs: map(best_hand7, hs), hands),
+                          ("evaluate7_many", evaluate7_many, encoded)]:
+        start = time.clock()
+        f(data)
+        elapsed = time.clock() - start
+        print "%-20s %10.0f hands/sec" % (name, nhands / elapsed)
+
+
+def bench_best_wild_hand(nhands=20):
+    deck = sorted(CARD_INTS)
+    rnd = random.Random(0)
+    hands = [rnd.sample(deck, 5) + sorted(JOKER_SUITS) for _ in xrange(nhands)]
+    for name, f in [("poker.best_wild_hand", poker.best_wild_hand),
+                    ("best_wild_hand", best_wild_hand)]:
+        start = time.clock()
+        for h in hands:
+            f(h)
+        elapsed = time.clock() - start
+        print "%-20s %10.1f hands/sec (two jokers)" % (name, nhands / elapsed)
+
+
+if __name__ == '__main__':
+    test_fast_hand_rank()
+    test_best_hand7()
+    test_best_wild_hand()
+    bench_hand_rank()
+    bench_best_hand()
+    bench_best_wild_hand()
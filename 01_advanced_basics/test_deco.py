@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from deco import *
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler(enabled=True)
+
+    def stats(self):
+        return {r['name']: r for r in self.profiler.export()}
+
+    def test_reset(self):
+        @profile("f", profiler=self.profiler)
+        def f():
+            pass
+        f()
+        self.profiler.reset()
+        self.assertEqual(self.profiler.export(), [])
+        f()
+        f()
+        self.assertEqual(self.stats()['f']['calls'], 2)
+
+    def test_sampling(self):
+        @profile("child", sample=1000, profiler=self.profiler)
+        def child():
+            time.sleep(0.002)
+
+        @profile("parent", profiler=self.profiler)
+        def parent():
+            for _ in xrange(5):
+                child()
+        parent()
+        stats = self.stats()
+        self.assertEqual(stats['child']['calls'], 5)
+        self.assertEqual(stats['child']['sampled'], 0)
+        self.assertEqual(stats['parent']['sampled'], 1)
+        self.assertGreaterEqual(stats['parent']['wall'], 0.01)
+        # unsampled callees are not charged to the parent's self time
+        self.assertLess(stats['parent']['self_wall'], 0.005)
+
+    def test_sampled_calls(self):
+        @profile("f", sample=3, profiler=self.profiler)
+        def f():
+            pass
+        for _ in xrange(10):
+            f()
+        self.assertEqual((self.stats()['f']['calls'], self.stats()['f']['sampled']), (10, 3))
+
+    def test_calls_threads(self):
+        @profile("f", sample=10, profiler=self.profiler)
+        def f():
+            pass
+
+        def run():
+            for _ in xrange(2000):
+                f()
+        threads = [threading.Thread(target=run) for _ in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual((self.stats()['f']['calls'], self.stats()['f']['sampled']), (8000, 800))
+
+    def test_disabled(self):
+        @profile("f", profiler=self.profiler)
+        def f():
+            return 1
+        self.profiler.enabled = False
+        self.assertEqual(f(), 1)
+        self.assertEqual(self.profiler.export(), [])
+
+
+class TestSharedMemo(unittest.TestCase):
+
+    def memoized(self, backend, calls):
+        @shared_memo(backend)
+        def f(x):
+            calls.append(x)
+            return x * 2
+
+        @shared_memo(backend)
+        def g(x):
+            return x * 3
+        return f, g
+
+    def check_clear(self, backend):
+        calls = []
+        f, g = self.memoized(backend, calls)
+        self.assertEqual((f(1), f(1), g(1)), (2, 2, 3))
+        self.assertEqual(calls, [1])
+        f.cache_clear()
+        self.assertEqual(f(1), 2)
+        self.assertEqual(calls, [1, 1])
+        # g keeps its values
+        self.assertEqual(backend.get(("test_deco.g", ((1,), ()))), (True, 3))
+
+    def test_dict_backend_clear(self):
+        self.check_clear(DictBackend())
+
+    def test_file_backend_clear(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        backend = FileBackend(path)
+        self.check_clear(backend)
+        self.assertTrue(any(fname.endswith('.lock') for fname in os.listdir(path)))
+
+    def test_unhashable_arguments(self):
+        calls = []
+
+        @shared_memo()
+        def total(xs):
+            calls.append(xs)
+            return sum(xs)
+        self.assertEqual((total([1, 2]), total([1, 2])), (3, 3))
+        self.assertEqual(len(calls), 2)
+
+    def test_processes_single_flight(self):
+        manager = multiprocessing.Manager()
+        self.addCleanup(manager.shutdown)
+        calls = manager.list()
+        backend = DictBackend(manager.dict(), manager.Lock())
+
+        @shared_memo(backend)
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.2)
+            return x
+
+        procs = [multiprocessing.Process(target=slow, args=(1,)) for _ in xrange(3)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        self.assertEqual(list(calls), [1])
+        self.assertEqual(slow(1), 1)
+
+    def check_recursive(self, backend):
+        @shared_memo(backend)
+        def fib(n):
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+        self.assertEqual(fib(30), 832040)
+
+    def test_recursive_thread_lock(self):
+        self.check_recursive(DictBackend(lock=threading.Lock()))
+
+    def test_recursive_processes(self):
+        manager = multiprocessing.Manager()
+        self.addCleanup(manager.shutdown)
+        backend = DictBackend(manager.dict(), manager.Lock())
+        procs = [multiprocessing.Process(target=self.check_recursive, args=(backend,))
+                 for _ in xrange(2)]
+        for p in procs:
+            p.start()
+        self.check_recursive(backend)
+        for p in procs:
+            p.join(10)
+            self.assertEqual(p.exitcode, 0)
+
+    def test_processes_different_keys(self):
+        manager = multiprocessing.Manager()
+        self.addCleanup(manager.shutdown)
+        backend = DictBackend(manager.dict(), manager.Lock())
+
+        @shared_memo(backend)
+        def slow(x):
+            time.sleep(0.3)
+            return x
+
+        procs = [multiprocessing.Process(target=slow, args=(i,)) for i in xrange(3)]
+        start = time.time()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        # computed concurrently, not one key at a time
+        self.assertLess(time.time() - start, 0.8)
+        self.assertEqual([slow(i) for i in xrange(3)], [0, 1, 2])
+
+
+class TestNAry(unittest.TestCase):
+
+    def test_thread_pool(self):
+        pool = ThreadPool(2)
+        self.addCleanup(pool.terminate)
+
+        @n_ary(associative=True, pool=pool)
+        def add(a, b):
+            return a + b
+        for n in (1, 2, 7, 64):
+            self.assertEqual(add(*range(n)), sum(range(n)))
+
+    def test_fold_order(self):
+        @n_ary
+        def sub(a, b):
+            return a - b
+        self.assertEqual(sub(10, 4, 3), 10 - (4 - 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
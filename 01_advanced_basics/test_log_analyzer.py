@@ -3,7 +3,11 @@
 
 import re
 import json
+import gzip
 import mock
+import os
+import shutil
+import tempfile
 import unittest
 
 import log_analyzer
@@ -29,6 +33,14 @@ FAKE_STATS = [
 ]
 
 
+GOOD_LINE = ('1.169.137.128 -  - [30/Jun/2017:03:28:23 +0300] '
+             '"GET /api/v2/group/1240146/banners HTTP/1.1" 200 994 "-" '
+             '"Configovod" "-" "1498782502-2118016444-4707-10488733" '
+             '"712e90144abee9" 0.643\n')
+BAD_REQUEST_LINE = ('1.202.56.176 -  - [29/Jun/2017:03:59:15 +0300]'
+                    ' "0" 400 166 "-" "-" "-" "-" "-" 0.000\n')
+
+
 class TetsLogAnalyzer(unittest.TestCase):
 
     def test_median_odd(self):
@@ -155,6 +167,157 @@ class TetsLogAnalyzer(unittest.TestCase):
         self.assertEqual(mock_parse_line.call_count, 2)
         self.assertEqual(res, records)
 
+    def test_parse_line_sentinel(self):
+        regexp = re.compile(UI_SHORT_REGEXP)
+        self.assertEqual(log_analyzer._parse_line(regexp, GOOD_LINE),
+                         LogRecord(url="/api/v2/group/1240146/banners",
+                                   request_time=0.643))
+        self.assertEqual(log_analyzer._parse_line(regexp, 'bad fmt line'),
+                         BadLine('format', 'bad fmt line'))
+        self.assertEqual(log_analyzer._parse_line(regexp, BAD_REQUEST_LINE),
+                         BadLine('request', BAD_REQUEST_LINE))
+        bad_time = GOOD_LINE.replace('0.643', '0.6.43')
+        self.assertEqual(log_analyzer._parse_line(regexp, bad_time),
+                         BadLine('request_time', bad_time))
+
+    def _write_log(self, lines):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        fpath = os.path.join(tmpdir, 'nginx-access-ui.log-20170630')
+        with open(fpath, 'w') as f:
+            f.writelines(lines)
+        return fpath
+
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_sentinel(self, mock_error):
+        fpath = self._write_log([GOOD_LINE] * 6 + ['junk\n'] * 3 + [BAD_REQUEST_LINE])
+        errors = {}
+        res = list(log_analyzer.nginx_log_parser(fpath, False, 0.5, mode='sentinel',
+                                                 errors=errors, log_limit=2))
+        self.assertEqual(len(res), 6)
+        self.assertEqual(errors, {'format': 3, 'request': 1})
+        # only log_limit lines per reason are logged
+        self.assertEqual(mock_error.call_count, 3)
+
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_sentinel_ratio(self, mock_error):
+        fpath = self._write_log([GOOD_LINE] * 8 + ['junk\n'] * 2)
+        self.assertRaises(RuntimeError, list,
+                          log_analyzer.nginx_log_parser(fpath, False, 0.1, mode='sentinel'))
+
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_sentinel_no_early_abort(self, mock_error):
+        # bad lines at the start are within the limit for the whole file
+        for bad, good, ratio in [(3, 997, 0.02), (20, 1980, 0.01)]:
+            fpath = self._write_log(['junk\n'] * bad + [GOOD_LINE] * good)
+            res = list(log_analyzer.nginx_log_parser(fpath, False, ratio, mode='sentinel'))
+            self.assertEqual(len(res), good)
+
+    def _check_early_abort(self, fpath, is_gz):
+        # 30 lines of 2 bytes: after k bad lines there are at most
+        # k + (60 - 2k) lines, 0.5 of it is exceeded at k = 21
+        with mock.patch('log_analyzer._parse_line',
+                        wraps=log_analyzer._parse_line) as mock_parse:
+            self.assertRaises(RuntimeError, list,
+                              log_analyzer.nginx_log_parser(fpath, is_gz, 0.5, mode='sentinel'))
+        self.assertEqual(mock_parse.call_count, 21)
+
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_sentinel_early_abort(self, mock_error):
+        self._check_early_abort(self._write_log(['x\n'] * 30), False)
+
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_sentinel_gz_early_abort(self, mock_error):
+        fpath = self._write_log([]) + '.gz'
+        with gzip.open(fpath, 'wb') as f:
+            f.writelines(['x\n'] * 30)
+        self._check_early_abort(fpath, True)
+
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_sentinel_gz_zero_ratio(self, mock_error):
+        fpath = self._write_log([])
+        with gzip.open(fpath + '.gz', 'wb') as f:
+            f.writelines([GOOD_LINE, 'junk\n'] + [GOOD_LINE] * 10)
+        it = log_analyzer.nginx_log_parser(fpath + '.gz', True, 0.0, mode='sentinel')
+        self.assertEqual(next(it).url, "/api/v2/group/1240146/banners")
+        self.assertRaises(RuntimeError, next, it)
+
+    def test_log_format_parity(self):
+        fmt = compile_log_format(UI_SHORT_LOG_FORMAT)
+        record_regexp = re.compile(UI_SHORT_REGEXP)
+        for line in [GOOD_LINE, BAD_REQUEST_LINE, 'junk\n']:
+            self.assertEqual(fmt.parse(line), log_analyzer._parse_line(record_regexp, line))
+        # UI_SHORT_REGEXP allows only digits in $request_time
+        self.assertEqual(fmt.parse(GOOD_LINE.replace('0.643', 'x')).reason, 'request_time')
+        # only the fields of the report are captured
+        self.assertEqual(sorted(fmt.regexp.groupindex), ['request', 'request_time'])
+
+    def test_log_format_cached(self):
+        self.assertIs(compile_log_format(UI_SHORT_LOG_FORMAT),
+                      compile_log_format(UI_SHORT_LOG_FORMAT))
+        log_format = UI_SHORT_LOG_FORMAT + ' $upstream_response_time'
+        self.assertIsNot(compile_log_format(log_format),
+                         compile_log_format(log_format, extra=True))
+
+    def test_log_format_extra(self):
+        fmt = compile_log_format('$remote_addr - $remote_user [$time_local] "$request" '
+                                 '$status $body_bytes_sent "$http_referer" '
+                                 '"$http_user_agent" $request_time ${upstream_response_time}',
+                                 extra=True)
+        line = ('1.2.3.4 - - [30/Jun/2017:03:28:23 +0300] "GET /api/1 HTTP/1.1" '
+                '502 0 "-" "curl/7.1 (x86_64)" 1.500 0.500, 0.900\n')
+        self.assertEqual(fmt.parse(line),
+                         DetailedLogRecord(url='/api/1', request_time=1.5,
+                                           status=502, upstream_time=1.4))
+        self.assertEqual(fmt.parse(line.replace('0.500, 0.900', '-')).upstream_time, None)
+        self.assertEqual(fmt.parse(line.replace('502', 'x')).reason, 'format')
+        self.assertEqual(fmt.parse(line.replace('0.500, 0.900', '.')).reason, 'extra')
+
+    def test_log_format_upstreams_before_space(self):
+        fmt = compile_log_format('$request_time "$request" $upstream_response_time $status',
+                                 extra=True)
+        self.assertEqual(fmt.parse('0.100 "GET /a HTTP/1.1" 0.5, 0.9 200\n'),
+                         DetailedLogRecord(url='/a', request_time=0.1,
+                                           status=200, upstream_time=1.4))
+        self.assertEqual(fmt.parse('0.100 "GET /a HTTP/1.1" 0.5 : -, 0.25 200\n').upstream_time,
+                         0.75)
+
+    def test_log_format_missing_field(self):
+        with self.assertRaises(ValueError):
+            compile_log_format('$remote_addr "$request"')
+
+    @mock.patch('log_analyzer.exception')
+    @mock.patch('log_analyzer.error')
+    def test_nginx_log_parser_log_format(self, mock_error, mock_exception):
+        fpath = self._write_log(['1.2.3.4 [30/Jun/2017:03:28:23 +0300] 0.100 "GET /a HTTP/1.1"\n',
+                                 'junk\n'])
+        log_format = '$remote_addr [$time_local] $request_time "$request"'
+        errors = {}
+        res = list(log_analyzer.nginx_log_parser(fpath, False, 0.5, mode='sentinel',
+                                                 errors=errors, log_format=log_format))
+        self.assertEqual(res, [LogRecord(url='/a', request_time=0.1)])
+        self.assertEqual(errors, {'format': 1})
+        with self.assertRaises(RuntimeError):
+            list(log_analyzer.nginx_log_parser(fpath, False, 0.0, log_format=log_format))
+
+    @mock.patch('log_analyzer.exception')
+    def test_nginx_log_parser_log_format_exception_mode(self, mock_exception):
+        fpath = self._write_log(['1.2.3.4 [30/Jun/2017:03:28:23 +0300] - "GET /a HTTP/1.1"\n',
+                                 '1.2.3.4 [30/Jun/2017:03:28:23 +0300] 0.2 "GET /b HTTP/1.1"\n'])
+        log_format = '$remote_addr [$time_local] $request_time "$request"'
+        res = list(log_analyzer.nginx_log_parser(fpath, False, 1.0, log_format=log_format))
+        self.assertEqual(res, [LogRecord(url='/b', request_time=0.2)])
+        self.assertEqual(mock_exception.call_count, 1)
+
+    def test_nginx_log_parser_log_format_extra(self):
+        fpath = self._write_log(['0.100 "GET /a HTTP/1.1" 0.5, 0.9 200\n'])
+        res = list(log_analyzer.nginx_log_parser(
+            fpath, False, 0.0, mode='sentinel',
+            log_format='$request_time "$request" $upstream_response_time $status',
+            log_format_extra=True))
+        self.assertEqual(res, [DetailedLogRecord(url='/a', request_time=0.1,
+                                                 status=200, upstream_time=1.4)])
+
     def test_collect_stats(self):
         records = [
             LogRecord(url='url1',
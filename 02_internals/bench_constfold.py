@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Сравнение исходных и обработанных constfold.bind_all функций
+# poker.hand_rank и log_analyzer._parse_single_line: число инструкций
+# (по dis), совпадение результатов и время.
+#
+# Оптимизируются копии модулей, загруженные под другими именами,
+# исходные модули остаются нетронутыми.
+#
+#     python bench_constfold.py [--dis]
+# -----------------
+
+import imp
+import os
+import random
+import re
+import sys
+import timeit
+from optparse import OptionParser
+
+import constfold
+
+ADVANCED_BASICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_advanced_basics')
+sys.path.insert(0, ADVANCED_BASICS)
+
+import log_analyzer
+import poker
+
+LOG_LINE = ('1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/25019354 HTTP/1.1" '
+            '200 927 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+            '"1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n')
+
+
+def load_copy(module, name):
+    return imp.load_source(name, os.path.splitext(module.__file__)[0] + '.py')
+
+
+def random_hands(n, seed=0):
+    rnd = random.Random(seed)
+    deck = [r + s for r in '23456789TJQKA' for s in 'CSHD']
+    return [rnd.sample(deck, 5) for _ in xrange(n)]
+
+
+def bench(name, orig, opt, args_list, number, repeat=15):
+    for args in args_list:
+        assert orig(*args) == opt(*args), (name, args)
+    run = lambda f: lambda: [f(*args) for args in args_list]
+    # запуски чередуются, чтобы шум одинаково влиял на обе версии
+    t_orig = t_opt = float('inf')
+    for _ in xrange(repeat):
+        t_orig = min(t_orig, timeit.timeit(run(orig), number=number))
+        t_opt = min(t_opt, timeit.timeit(run(opt), number=number))
+    calls = float(number * len(args_list))
+    print "%-22s %5d -> %5d instrs  %7.2f -> %7.2f us/call  x%.2f" % (
+        name, constfold.count_instructions(orig), constfold.count_instructions(opt),
+        t_orig / calls * 1e6, t_opt / calls * 1e6, t_orig / t_opt)
+
+
+def main():
+    op = OptionParser()
+    op.add_option("--dis", action="store_true", default=False, help="print optimized bytecode")
+    op.add_option("-n", action="store", type=int, default=20)
+    (opts, args) = op.parse_args()
+
+    poker_opt = load_copy(poker, 'poker_constfold')
+    log_opt = load_copy(log_analyzer, 'log_analyzer_constfold')
+    constfold.bind_all(poker_opt, verbose=opts.dis)
+    constfold.bind_all(log_opt, verbose=opts.dis)
+    if opts.dis:
+        import dis
+        dis.dis(poker_opt.hand_rank)
+        dis.dis(log_opt._parse_single_line)
+
+    hands = [(h,) for h in random_hands(2000)]
+    bench("poker.hand_rank", poker.hand_rank, poker_opt.hand_rank, hands, opts.n)
+    hands7 = [(h,) for h in random_hands(20, seed=1)]
+    bench("poker.best_hand", poker.best_hand, poker_opt.best_hand, hands7, opts.n)
+    regexp = re.compile(log_analyzer.UI_SHORT_REGEXP)
+    lines = [(regexp, LOG_LINE)] * 2000
+    bench("log._parse_single_line", log_analyzer._parse_single_line,
+          log_opt._parse_single_line, lines, opts.n)
+
+
+if __name__ == '__main__':
+    main()
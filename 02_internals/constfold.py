@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Оптимизация байткода функций (CPython 2.7) без изменения интерпретатора.
+#
+# Вместо суперинструкции LOAD_OTUS из патча код функции переписывается
+# при импорте:
+#   - LOAD_GLOBAL имён, известных на момент декорирования (глобальные
+#     константы, функции модуля, builtins), заменяется на LOAD_CONST,
+#     т.е. поиск в двух словарях - на чтение из co_consts;
+#   - LOAD_CONST <модуль>; LOAD_ATTR имя -> LOAD_CONST <атрибут>;
+#   - выражения из констант неизменяемых типов (a + b, -a, (a, b, c))
+#     вычисляются заранее.
+# Свёрнутые инструкции удаляются, переходы и co_lnotab пересчитываются.
+#
+# Семантика меняется: переприсвоенные позже глобальные имена и атрибуты
+# модулей (в т.ч. mock.patch) функция не увидит. Имена, которые функция
+# сама присваивает (global x; x = ...), не связываются.
+# -----------------
+
+import __builtin__
+import dis
+import operator
+import sys
+import types
+from opcode import opmap, HAVE_ARGUMENT, hasjrel, hasjabs, EXTENDED_ARG
+
+LOAD_GLOBAL = opmap['LOAD_GLOBAL']
+LOAD_CONST = opmap['LOAD_CONST']
+LOAD_ATTR = opmap['LOAD_ATTR']
+BUILD_TUPLE = opmap['BUILD_TUPLE']
+STORE_GLOBAL = opmap['STORE_GLOBAL']
+DELETE_GLOBAL = opmap['DELETE_GLOBAL']
+
+BINARY_OPS = {
+    opmap['BINARY_ADD']: operator.add,
+    opmap['BINARY_SUBTRACT']: operator.sub,
+    opmap['BINARY_MULTIPLY']: operator.mul,
+    opmap['BINARY_DIVIDE']: operator.div,
+    opmap['BINARY_TRUE_DIVIDE']: operator.truediv,
+    opmap['BINARY_FLOOR_DIVIDE']: operator.floordiv,
+    opmap['BINARY_MODULO']: operator.mod,
+    opmap['BINARY_POWER']: operator.pow,
+    opmap['BINARY_SUBSCR']: operator.getitem,
+    opmap['BINARY_LSHIFT']: operator.lshift,
+    opmap['BINARY_RSHIFT']: operator.rshift,
+    opmap['BINARY_AND']: operator.and_,
+    opmap['BINARY_OR']: operator.or_,
+    opmap['BINARY_XOR']: operator.xor,
+}
+UNARY_OPS = {
+    opmap['UNARY_POSITIVE']: operator.pos,
+    opmap['UNARY_NEGATIVE']: operator.neg,
+    opmap['UNARY_INVERT']: operator.invert,
+    opmap['UNARY_NOT']: operator.not_,
+}
+
+# Типы, значения которых можно вычислять заранее
+FOLDABLE = (int, long, float, complex, bool, str, unicode, tuple, frozenset, type(None))
+# Не создавать константы длиннее (как peephole.c для строк и кортежей)
+MAX_FOLDED_LEN = 20
+
+
+class Instr(object):
+    __slots__ = ('op', 'arg', 'offset', 'target')
+
+    def __init__(self, op, arg=None, offset=None, target=None):
+        self.op = op
+        self.arg = arg
+        # смещение в исходном коде; у свёрнутых - смещение первой инструкции
+        self.offset = offset
+        # исходное смещение цели перехода
+        self.target = target
+
+    def __repr__(self):
+        return "%s(%r)" % (dis.opname[self.op], self.arg)
+
+
+def decode(code):
+    """Инструкции co_code; None, если есть EXTENDED_ARG"""
+    co = code.co_code
+    instrs = []
+    i = 0
+    while i < len(co):
+        op = ord(co[i])
+        if op == EXTENDED_ARG:
+            return None
+        if op < HAVE_ARGUMENT:
+            instrs.append(Instr(op, None, i))
+            i += 1
+            continue
+        arg = ord(co[i + 1]) | ord(co[i + 2]) << 8
+        target = None
+        if op in hasjrel:
+            target = i + 3 + arg
+        elif op in hasjabs:
+            target = arg
+        instrs.append(Instr(op, arg, i, target))
+        i += 3
+    return instrs
+
+
+def assemble(instrs, code, consts):
+    """Новый объект кода из инструкций; смещения переходов и строк пересчитываются"""
+    new_offset = {}
+    pos = 0
+    for instr in instrs:
+        new_offset.setdefault(instr.offset, pos)
+        pos += 1 if instr.op < HAVE_ARGUMENT else 3
+    # удалённые инструкции отображаются на следующую сохранённую
+    mapped = []
+    nxt = pos
+    for i in reversed(xrange(len(code.co_code) + 1)):
+        nxt = new_offset.get(i, nxt)
+        mapped.append(nxt)
+    mapped.reverse()
+
+    out = []
+    pos = 0
+    for instr in instrs:
+        arg = instr.arg
+        size = 1 if instr.op < HAVE_ARGUMENT else 3
+        if instr.target is not None:
+            arg = mapped[instr.target]
+            if instr.op in hasjrel:
+                arg -= pos + 3
+        out.append(chr(instr.op))
+        if size == 3:
+            if not 0 <= arg < 1 << 16:
+                raise ValueError("Argument out of range: %r %d" % (instr, arg))
+            out.append(chr(arg & 0xff) + chr(arg >> 8))
+        pos += size
+
+    return types.CodeType(
+        code.co_argcount, code.co_nlocals, code.co_stacksize, code.co_flags,
+        "".join(out), tuple(consts), code.co_names, code.co_varnames,
+        code.co_filename, code.co_name, code.co_firstlineno,
+        _remap_lnotab(code, mapped), code.co_freevars, code.co_cellvars)
+
+
+def _remap_lnotab(code, mapped):
+    lnotab = code.co_lnotab
+    addr, line = 0, code.co_firstlineno
+    lines = []
+    for i in xrange(0, len(lnotab), 2):
+        addr += ord(lnotab[i])
+        line += ord(lnotab[i + 1])
+        lines.append((mapped[addr], line))
+    out = []
+    last_addr, last_line = 0, code.co_firstlineno
+    for addr, line in lines:
+        d_addr, d_line = addr - last_addr, line - last_line
+        while d_addr > 255:
+            out.append(chr(255) + chr(0))
+            d_addr -= 255
+        while d_line > 255:
+            out.append(chr(d_addr) + chr(255))
+            d_addr, d_line = 0, d_line - 255
+        out.append(chr(d_addr) + chr(d_line))
+        last_addr, last_line = addr, line
+    return "".join(out)
+
+
+def validate(code):
+    """Проверки нового кода: переходы на начало инструкций, индексы в пределах таблиц"""
+    instrs = decode(code)
+    starts = set(instr.offset for instr in instrs)
+    for instr in instrs:
+        if instr.target is not None and instr.target not in starts:
+            raise ValueError("%s: jump into the middle of an instruction: %r"
+                             % (code.co_name, instr))
+        if instr.op == LOAD_CONST and instr.arg >= len(code.co_consts):
+            raise ValueError("%s: no constant #%d" % (code.co_name, instr.arg))
+        if instr.op in dis.hasname and instr.arg >= len(code.co_names):
+            raise ValueError("%s: no name #%d" % (code.co_name, instr.arg))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            validate(const)
+
+
+class _Consts(object):
+    """co_consts, пополняемый новыми значениями"""
+    def __init__(self, consts):
+        self.values = list(consts)
+
+    def index(self, value):
+        for i, c in enumerate(self.values):
+            # 1, 1.0 и True (и (1,) с (1.0,)) равны, поэтому сравниваются ещё тип и repr
+            if c is value or (type(c) is type(value) and isinstance(c, FOLDABLE)
+                              and c == value and repr(c) == repr(value)):
+                return i
+        self.values.append(value)
+        return len(self.values) - 1
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+
+def _foldable(value):
+    if not isinstance(value, FOLDABLE):
+        return False
+    if isinstance(value, (int, long)):
+        return value.bit_length() <= 128
+    try:
+        return len(value) <= MAX_FOLDED_LEN
+    except TypeError:
+        return True
+
+
+def optimize_code(code, env, fold_attrs=True, stats=None):
+    """
+    Код с подставленными значениями env (имя -> значение) вместо LOAD_GLOBAL
+    и свёрнутыми константами. stats (dict) получает число замен.
+    """
+    instrs = decode(code)
+    if instrs is None:
+        return code
+    stats = stats if stats is not None else {}
+    consts = _Consts(code.co_consts)
+    stored = set(code.co_names[i.arg] for i in instrs if i.op in (STORE_GLOBAL, DELETE_GLOBAL))
+    targets = set(i.target for i in instrs if i.target is not None)
+
+    def count(key):
+        stats[key] = stats.get(key, 0) + 1
+
+    def const(instr):
+        return consts[instr.arg]
+
+    def is_const(instr):
+        return instr.op == LOAD_CONST
+
+    def can_merge(tail):
+        # внутрь свёртываемой последовательности не должно быть переходов
+        return all(i.offset not in targets for i in tail[1:])
+
+    out = []
+    for instr in instrs:
+        if instr.op == LOAD_GLOBAL:
+            name = code.co_names[instr.arg]
+            if name in env and name not in stored:
+                instr = Instr(LOAD_CONST, consts.index(env[name]), instr.offset)
+                count('globals')
+        out.append(instr)
+
+        while True:
+            last = out[-1]
+            n = None
+            if last.op in BINARY_OPS and len(out) >= 3 and is_const(out[-2]) and is_const(out[-3]):
+                n, args, func = 3, (const(out[-3]), const(out[-2])), BINARY_OPS[last.op]
+            elif last.op in UNARY_OPS and len(out) >= 2 and is_const(out[-2]):
+                n, args, func = 2, (const(out[-2]),), UNARY_OPS[last.op]
+            elif (last.op == BUILD_TUPLE and len(out) > last.arg and
+                  all(is_const(i) for i in out[len(out) - last.arg - 1:-1])):
+                n, func = last.arg + 1, lambda *a: a
+                args = tuple(const(i) for i in out[len(out) - n:-1])
+            elif (fold_attrs and last.op == LOAD_ATTR and len(out) >= 2 and is_const(out[-2])
+                  and isinstance(const(out[-2]), types.ModuleType)):
+                module, attr = const(out[-2]), code.co_names[last.arg]
+                if hasattr(module, attr):
+                    n, args, func = 2, (module, attr), getattr
+            if n is None or not can_merge(out[-n:]):
+                break
+            if func is not getattr and not all(_foldable(a) for a in args):
+                break
+            try:
+                value = func(*args)
+            except Exception:
+                break
+            if func is not getattr and not _foldable(value):
+                break
+            first = out[-n]
+            del out[-n:]
+            out.append(Instr(LOAD_CONST, consts.index(value), first.offset))
+            count('attrs' if func is getattr else 'folded')
+
+    # вложенные функции, генераторы и lambda
+    for i, c in enumerate(consts.values):
+        if isinstance(c, types.CodeType):
+            consts.values[i] = optimize_code(c, env, fold_attrs, stats)
+
+    new = assemble(out, code, consts.values)
+    validate(new)
+    return new
+
+
+def _env(func_globals, builtins=True, stoplist=()):
+    env = {}
+    if builtins:
+        env.update(vars(__builtin__))
+    env.update(func_globals)
+    for name in stoplist:
+        env.pop(name, None)
+    return env
+
+
+def bind_constants(func=None, builtins=True, stoplist=(), fold_attrs=True, verbose=False):
+    """
+    Декоратор: заменяет код функции оптимизированным (глобальные имена
+    связываются со значениями на момент вызова декоратора, поэтому его
+    стоит применять после определения всего, что функция использует).
+    """
+    def decorate(func):
+        stats = {}
+        func.func_code = optimize_code(func.func_code, _env(func.func_globals, builtins, stoplist),
+                                       fold_attrs, stats)
+        if verbose:
+            print "%s: %s" % (func.__name__, stats)
+        return func
+    if func is None:
+        return decorate
+    return decorate(func)
+
+
+def bind_all(mc, builtins=True, stoplist=(), fold_attrs=True, verbose=False):
+    """bind_constants для всех функций и методов, определённых в модуле или классе mc"""
+    if isinstance(mc, types.ModuleType):
+        module_globals = vars(mc)
+    else:
+        module_globals = vars(sys.modules[mc.__module__])
+    for v in vars(mc).values():
+        if isinstance(v, (staticmethod, classmethod)):
+            v = v.__func__
+        if type(v) is types.FunctionType and v.func_globals is module_globals:
+            bind_constants(v, builtins, stoplist, fold_attrs, verbose)
+        elif (isinstance(v, (type, types.ClassType)) and v is not mc and
+              v.__module__ == module_globals['__name__']):
+            bind_all(v, builtins, stoplist, fold_attrs, verbose)
+
+
+def count_instructions(func):
+    """Число инструкций в коде функции (включая вложенный код)"""
+    def _count(code):
+        return len(decode(code) or []) + sum(
+            _count(c) for c in code.co_consts if isinstance(c, types.CodeType))
+    return _count(func.func_code)
+
+
+# ---------------- тесты ----------------
+
+K = 10
+NAMES = ("a", "b")
+
+
+def _sample(x):
+    return x * K + len(NAMES) - (K * 2 + -K) + abs(-x)
+
+
+def _with_loop(xs):
+    total = 0
+    for x in xs:
+        if x > K:
+            total += x
+        elif x < -K:
+            break
+        else:
+            continue
+    return [y + K for y in xs if y], total
+
+
+def _assigns():
+    global K
+    K = K + 1
+    return K
+
+
+def test_bind_constants():
+    print "test_bind_constants..."
+    for func, args in [(_sample, (3,)), (_with_loop, ([1, 20, 30, -5, 0, -20, 40],))]:
+        expected = func(*args)
+        f = types.FunctionType(func.func_code, func.func_globals, func.__name__)
+        stats = {}
+        f.func_code = optimize_code(f.func_code, _env(f.func_globals), stats=stats)
+        assert f(*args) == expected, (f(*args), expected)
+        assert 'LOAD_GLOBAL' not in _disasm(f)
+        assert count_instructions(f) < count_instructions(func)
+    f = types.FunctionType(_sample.func_code, _sample.func_globals)
+    bind_constants(f)
+    # K * 2 + -K свёрнуто в константу
+    assert 10 in f.func_code.co_consts
+    f = types.FunctionType(_assigns.func_code, globals())
+    bind_constants(f)
+    assert 'LOAD_GLOBAL' in _disasm(f)
+    # связывание модуля и атрибута
+    f = bind_constants(lambda x: operator.neg(x))
+    assert 'LOAD_GLOBAL' not in _disasm(f) and 'LOAD_ATTR' not in _disasm(f) and f(1) == -1
+    print 'OK'
+
+
+def test_line_numbers():
+    print "test_line_numbers..."
+    import traceback
+
+    def fail(x):
+        y = K + 1
+        raise ValueError(x + y)
+    f = bind_constants(types.FunctionType(fail.func_code, fail.func_globals))
+    try:
+        f(1)
+    except ValueError:
+        lineno = traceback.extract_tb(sys.exc_info()[2])[-1][1]
+    assert lineno == fail.func_code.co_firstlineno + 2, lineno
+    print 'OK'
+
+
+def _disasm(func):
+    from StringIO import StringIO
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        dis.dis(func)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+if __name__ == '__main__':
+    test_bind_constants()
+    test_line_numbers()
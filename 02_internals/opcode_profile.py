@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Профилировщик частот опкодов и пар опкодов (биграмм) - кандидатов
+# в суперинструкции вроде LOAD_OTUS (LOAD_FAST + LOAD_CONST).
+#
+# В Python 2.7 нет frame.f_trace_opcodes (он появился в 3.7), поэтому
+# коду профилируемых функций подменяется co_lnotab: каждая инструкция
+# получает свою "строку", и sys.settrace присылает событие 'line' на
+# каждую выполненную инструкцию. Опкод читается из co_code по f_lasti.
+# Номера строк в трейсбеках при этом не соответствуют исходнику.
+#
+# Профилируется код скрипта и модулей, импортируемых из его каталога
+# (или из --path):
+#
+#     python opcode_profile.py ../01_advanced_basics/poker.py
+#     python opcode_profile.py --top 30 ../01_advanced_basics/test_log_analyzer.py
+# -----------------
+
+from collections import Counter
+import dis
+import imp
+import os
+import sys
+import types
+from optparse import OptionParser
+
+from constfold import decode
+
+# Пары, которые CPython 2.7 уже ускоряет через PREDICT() в ceval.c:
+# вторая инструкция выполняется без полного цикла диспетчеризации.
+PREDICTED = set([
+    ('COMPARE_OP', 'POP_JUMP_IF_FALSE'),
+    ('COMPARE_OP', 'POP_JUMP_IF_TRUE'),
+    ('GET_ITER', 'FOR_ITER'),
+    ('FOR_ITER', 'STORE_FAST'),
+    ('FOR_ITER', 'UNPACK_SEQUENCE'),
+    ('LIST_APPEND', 'JUMP_ABSOLUTE'),
+    ('SET_ADD', 'JUMP_ABSOLUTE'),
+    ('MAP_ADD', 'JUMP_ABSOLUTE'),
+])
+
+
+def instrument_code(code, registry):
+    """Копия code (и вложенного кода), где каждая инструкция - отдельная строка"""
+    instrs = decode(code)
+    if instrs is None:
+        return code
+    lnotab = "".join(chr(instrs[i + 1].offset - instr.offset) + chr(1)
+                     for i, instr in enumerate(instrs[:-1]))
+    consts = tuple(instrument_code(c, registry) if isinstance(c, types.CodeType) else c
+                   for c in code.co_consts)
+    new = types.CodeType(
+        code.co_argcount, code.co_nlocals, code.co_stacksize, code.co_flags,
+        code.co_code, consts, code.co_names, code.co_varnames,
+        code.co_filename, code.co_name, code.co_firstlineno, lnotab,
+        code.co_freevars, code.co_cellvars)
+    registry.add(new)
+    return new
+
+
+class OpcodeProfiler(object):
+    def __init__(self):
+        self.opcodes = Counter()
+        self.bigrams = Counter()
+        self.instrumented = set()
+        self._prev = {}
+
+    def instrument(self, code):
+        return instrument_code(code, self.instrumented)
+
+    def _global_trace(self, frame, event, arg):
+        if frame.f_code in self.instrumented:
+            return self._local_trace
+        return None
+
+    def _local_trace(self, frame, event, arg):
+        if event == 'line':
+            op = dis.opname[ord(frame.f_code.co_code[frame.f_lasti])]
+            self.opcodes[op] += 1
+            prev = self._prev.get(frame)
+            if prev is not None:
+                self.bigrams[prev, op] += 1
+            self._prev[frame] = op
+        elif event == 'return':
+            # генераторы при возобновлении начинают новую цепочку
+            self._prev.pop(frame, None)
+        return self._local_trace
+
+    def run(self, func, *args, **kwargs):
+        sys.settrace(self._global_trace)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.settrace(None)
+
+    def run_path(self, path, argv=(), paths=None):
+        """Выполняет скрипт path как __main__, профилируя его и модули из paths"""
+        path = os.path.abspath(path)
+        paths = [os.path.abspath(p) for p in (paths or [os.path.dirname(path)])]
+        with open(path) as f:
+            code = self.instrument(compile(f.read(), path, 'exec'))
+        importer = InstrumentingImporter(self, paths)
+        saved = sys.argv, sys.path[:], sys.modules.get('__main__')
+        main = imp.new_module('__main__')
+        main.__file__ = path
+        sys.argv = [path] + list(argv)
+        sys.path[:0] = paths
+        sys.meta_path.insert(0, importer)
+        sys.modules['__main__'] = main
+        try:
+            self.run(_exec, code, vars(main))
+        except SystemExit:
+            pass
+        finally:
+            sys.meta_path.remove(importer)
+            sys.argv, sys.path[:] = saved[0], saved[1]
+            sys.modules['__main__'] = saved[2]
+
+    def report(self, top=20, dispatch_ns=None, out=sys.stdout):
+        total = sum(self.opcodes.values())
+        if not total:
+            print >> out, "no instructions traced"
+            return
+        print >> out, "%d instructions traced, %d distinct opcodes, %d distinct pairs" % (
+            total, len(self.opcodes), len(self.bigrams))
+        print >> out
+        print >> out, "%-24s %12s %7s" % ("opcode", "count", "%")
+        for op, n in self.opcodes.most_common(top):
+            print >> out, "%-24s %12d %6.2f%%" % (op, n, 100.0 * n / total)
+        print >> out
+        # Слияние пары убирает одну диспетчеризацию на каждое её выполнение.
+        header = "%-44s %12s %9s" % ("superinstruction candidate", "count", "saved")
+        if dispatch_ns:
+            header += " %10s" % "est. ms"
+        print >> out, header
+        for (a, b), n in self.bigrams.most_common(top):
+            line = "%-44s %12d %8.2f%%" % ("%s + %s" % (a, b), n, 100.0 * n / total)
+            if dispatch_ns:
+                line += " %10.2f" % (n * dispatch_ns / 1e6)
+            if (a, b) in PREDICTED:
+                line += "  (already PREDICTed)"
+            elif (a, b) == ('LOAD_FAST', 'LOAD_CONST'):
+                line += "  (LOAD_OTUS)"
+            print >> out, line
+
+
+def _exec(code, namespace):
+    exec code in namespace
+
+
+class InstrumentingImporter(object):
+    """PEP 302 импортёр модулей-исходников из paths с инструментированным кодом"""
+    def __init__(self, profiler, paths):
+        self.profiler = profiler
+        self.paths = paths
+        self._found = {}
+
+    def find_module(self, fullname, path=None):
+        if '.' in fullname:
+            return None
+        try:
+            f, filename, (suffix, mode, kind) = imp.find_module(fullname, self.paths)
+        except ImportError:
+            return None
+        if f is not None:
+            f.close()
+        if kind != imp.PY_SOURCE:
+            return None
+        self._found[fullname] = filename
+        return self
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        filename = self._found.pop(fullname)
+        with open(filename) as f:
+            code = self.profiler.instrument(compile(f.read(), filename, 'exec'))
+        module = imp.new_module(fullname)
+        module.__file__ = filename
+        module.__loader__ = self
+        sys.modules[fullname] = module
+        try:
+            _exec(code, vars(module))
+        except Exception:
+            del sys.modules[fullname]
+            raise
+        return module
+
+
+def test_profiler():
+    print "test_profiler..."
+
+    def f(n):
+        total = 0
+        for i in xrange(n):
+            total += i * 2
+        return total
+    p = OpcodeProfiler()
+    g = types.FunctionType(p.instrument(f.func_code), f.func_globals)
+    assert p.run(g, 10) == f(10)
+    # тело цикла выполнилось 10 раз
+    assert p.opcodes['INPLACE_ADD'] == 10 and p.opcodes['BINARY_MULTIPLY'] == 10
+    assert p.bigrams['LOAD_FAST', 'LOAD_CONST'] == 10
+    assert p.opcodes['FOR_ITER'] == 11 and p.opcodes['RETURN_VALUE'] == 1
+    print 'OK'
+
+
+def main():
+    op = OptionParser(usage="%prog [options] script.py [args]")
+    op.disable_interspersed_args()
+    op.add_option("--top", action="store", type=int, default=20)
+    op.add_option("--path", action="append", default=None,
+                  help="profile modules imported from this directory (default: the script's)")
+    op.add_option("--dispatch-ns", action="store", type=float, default=None,
+                  help="assumed cost of one dispatch to estimate the time saved")
+    op.add_option("--test", action="store_true", default=False)
+    (opts, args) = op.parse_args()
+    if opts.test:
+        test_profiler()
+        return
+    if not args:
+        op.error("script is required")
+    profiler = OpcodeProfiler()
+    profiler.run_path(args[0], args[1:], opts.path)
+    sys.stdout.flush()
+    profiler.report(opts.top, opts.dispatch_ns)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import threading
+import Queue
+
+import numpy as np
+from scipy import sparse
+
+
+def csr_from_arrays(data, indices, indptr, shape):
+    """CSR matrix on top of the given arrays (e.g. views or memmaps), no copies"""
+    # csr_matrix((data, indices, indptr)) would copy small views of
+    # large arrays (see prune()), so the arrays are assigned directly.
+    res = sparse.csr_matrix(shape, dtype=data.dtype)
+    res.data = data
+    res.indices = indices
+    res.indptr = indptr
+    return res
+
+
+def csr_row_slice(X, start, stop):
+    """Rows start:stop of a CSR matrix, sharing data and indices with X"""
+    indptr = X.indptr[start:stop + 1]
+    lo, hi = indptr[0], indptr[-1]
+    return csr_from_arrays(X.data[lo:hi], X.indices[lo:hi], indptr - lo,
+                           (stop - start, X.shape[1]))
+
+
+def random_batches(X, y, batch_size, rng=np.random):
+    """Endless batches sampled with replacement (copies every batch)"""
+    while True:
+        batch_indices = rng.choice(X.shape[0], size=batch_size, replace=True)
+        yield X[batch_indices], y[batch_indices]
+
+
+class EpochBatches(object):
+    """
+    Endless mini-batches over X, y. Rows are permuted once per epoch
+    (one copy of X), after that every batch is a contiguous slice that
+    shares memory with the permuted matrix. With prefetch=True batches
+    are produced by a background thread, so the per-epoch shuffle
+    overlaps with training.
+    """
+    def __init__(self, X, y, batch_size, shuffle=True, seed=None, prefetch=False):
+        self.X = X.tocsr() if sparse.issparse(X) else X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.epochs = 0
+        self._rng = np.random.RandomState(seed)
+
+    def _epoch(self):
+        if self.shuffle:
+            perm = self._rng.permutation(self.X.shape[0])
+            X, y = self.X[perm], self.y[perm]
+        else:
+            X, y = self.X, self.y
+        for start in xrange(0, X.shape[0], self.batch_size):
+            stop = min(start + self.batch_size, X.shape[0])
+            if sparse.isspmatrix_csr(X):
+                yield csr_row_slice(X, start, stop), y[start:stop]
+            else:
+                yield X[start:stop], y[start:stop]
+        self.epochs += 1
+
+    def _batches(self):
+        while True:
+            for batch in self._epoch():
+                yield batch
+
+    def __iter__(self):
+        if self.prefetch:
+            return prefetched(self._batches())
+        return self._batches()
+
+
+def prefetched(iterable, size=2):
+    """Run iterable in a background thread, keeping up to size items ready"""
+    queue = Queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def _produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        queue.put(item, timeout=0.1)
+                        break
+                    except Queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+        finally:
+            while not stop.is_set():
+                try:
+                    queue.put(done, timeout=0.1)
+                    break
+                except Queue.Full:
+                    pass
+
+    thread = threading.Thread(target=_produce, name="batch-prefetch")
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
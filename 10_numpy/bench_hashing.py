@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of HashingVectorizer on synthetic review-like documents
+(Zipf-distributed words, the label depends on a few "sentiment" words),
+followed by LogisticRegression trained on the hashed features.
+
+    python bench_hashing.py -n 200000 --processes 4
+"""
+
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from hashing import HashingVectorizer
+from logistic_regression import LogisticRegression
+
+
+def make_docs(n, vocab_size=50000, words_per_doc=12, seed=0):
+    rng = np.random.RandomState(seed)
+    vocab = np.array(["w%d" % i for i in xrange(vocab_size)])
+    weights = rng.randn(vocab_size)
+    docs, y = [], np.empty(n)
+    for i in xrange(n):
+        ids = np.minimum(rng.zipf(1.2, size=rng.poisson(words_per_doc) + 1) - 1, vocab_size - 1)
+        docs.append(" ".join(vocab[ids]))
+        y[i] = weights[ids].sum() > 0
+    return docs, y
+
+
+def main():
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=100000)
+    op.add_option("--n-features", action="store", type=int, default=2 ** 18)
+    op.add_option("--processes", action="store", type=int, default=4)
+    (opts, args) = op.parse_args()
+
+    docs, y = make_docs(opts.n)
+    vectorizer = HashingVectorizer(n_features=opts.n_features)
+    processes = 1
+    while processes <= opts.processes:
+        start = time.time()
+        X = vectorizer.transform(docs, processes=processes)
+        print "transform, %d processes: %6.2fs, %8.0f docs/sec" % (
+            processes, time.time() - start, opts.n / (time.time() - start))
+        processes *= 2
+
+    split = int(0.7 * opts.n)
+    clf = LogisticRegression()
+    clf.train(X[:split], y[:split], learning_rate=1.0, reg=1e-5, num_iters=2000, batch_size=256)
+    print "test acc %.3f" % np.mean(clf.predict(X[split:]) == y[split:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for LogisticRegression on synthetic TF-IDF-like data
+(l2-normalized sparse rows, a few dozen terms per row, Zipf-distributed
+vocabulary), similar to the notebook's review summaries.
+
+    python bench_logistic_regression.py -n 100000 -d 20000
+"""
+
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+import numpy as np
+from scipy import sparse
+
+from batching import EpochBatches, random_batches
+from logistic_regression import LogisticRegression
+from streaming import CSRWriter, MemmapCSR, text_batches, write_text
+
+
+def make_tfidf_like(n, d, terms_per_row=20, seed=0):
+    """Random CSR matrix with TF-IDF-like rows and labels of a linear model"""
+    rng = np.random.RandomState(seed)
+    nnz = rng.poisson(terms_per_row, size=n) + 1
+    indptr = np.concatenate([[0], np.cumsum(nnz)])
+    indices = np.minimum(rng.zipf(1.3, size=indptr[-1]) - 1, d - 1)
+    data = rng.rand(indptr[-1]) + 0.1
+    X = sparse.csr_matrix((data, indices, indptr), shape=(n, d))
+    X.sum_duplicates()
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    X = sparse.diags(1.0 / norms).dot(X).tocsr()
+    w_true = rng.randn(d) * 3
+    y = (X.dot(w_true) + rng.randn(n) * 0.1 > 0).astype(np.float64)
+    return X, y
+
+
+def old_loss(w, X_batch, y_batch, reg):
+    """LogisticRegression.loss as it was: sigma evaluated three times"""
+    sigma = lambda X: 1.0 / (1.0 + np.exp(-1.0 * X.dot(w)))
+    loss = -1.0 * np.sum(
+        y_batch * np.log(sigma(X_batch)) +
+        (1 - y_batch) * (1 - np.log(sigma(X_batch)))
+    )
+    dw = -1.0 * (y_batch - sigma(X_batch)) * X_batch
+    num_train = X_batch.shape[0]
+    loss /= num_train
+    dw /= num_train
+    w = w[:-1]
+    loss += reg * np.sum(w * w) / w.shape[0]
+    dw[:-1] += reg * 2 * w / w.shape[0]
+    return loss, dw
+
+
+def old_predict_proba(w, X):
+    """LogisticRegression.predict_proba as it was: hstack a bias column first"""
+    p = 1.0 / (1.0 + np.exp(-1.0 * LogisticRegression.append_biases(X).dot(w)))
+    return np.vstack([p, 1 - p]).T
+
+
+def timeit(f, repeat):
+    start = time.time()
+    for _ in xrange(repeat):
+        f()
+    return (time.time() - start) / repeat
+
+
+def accuracy(clf, X, y):
+    return np.mean(clf.predict(X) == y)
+
+
+def check_gradient(X, y, reg=1e-3, eps=1e-6, ncheck=10, seed=0):
+    rng = np.random.RandomState(seed)
+    w = rng.randn(X.shape[1]) * 0.1
+    _, grad = LogisticRegression.loss_grad(w, X, y, reg)
+    for i in rng.choice(len(w), ncheck, replace=False):
+        dw = np.zeros_like(w)
+        dw[i] = eps
+        num = (LogisticRegression.loss_grad(w + dw, X, y, reg)[0] -
+               LogisticRegression.loss_grad(w - dw, X, y, reg)[0]) / (2 * eps)
+        assert abs(num - grad[i]) <= 1e-5 * max(1.0, abs(num)), (i, num, grad[i])
+
+
+def bench_streaming(tmpdir, X_train, y_train, X_test, y_test, opts):
+    start = time.time()
+    with CSRWriter(os.path.join(tmpdir, "csr"), X_train.shape[1]) as writer:
+        for lo in xrange(0, X_train.shape[0], 10000):
+            writer.append(X_train[lo:lo + 10000], y_train[lo:lo + 10000])
+    print "memmap CSR written in %.2fs" % (time.time() - start)
+    start = time.time()
+    with open(os.path.join(tmpdir, "train.svm"), "w") as f:
+        write_text(f, X_train, y_train)
+    print "svmlight text written in %.2fs" % (time.time() - start)
+
+    X_mm = MemmapCSR(os.path.join(tmpdir, "csr"))
+    for name, batches in [
+            ("stream memmap", X_mm.batches(opts.batch_size, seed=0)),
+            ("stream text", text_batches(os.path.join(tmpdir, "train.svm"),
+                                         X_train.shape[1], opts.batch_size))]:
+        np.random.seed(0)
+        clf = LogisticRegression()
+        start = time.time()
+        clf.train_stream(batches, learning_rate=1.0, reg=1e-3, num_iters=opts.num_iters)
+        elapsed = time.time() - start
+        print "%-20s %d iters: %6.2fs, loss %.4f, test acc %.3f" % (
+            name, len(clf.loss_history), elapsed, clf.loss_history[-1],
+            accuracy(clf, X_test, y_test))
+
+
+def main():
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=100000)
+    op.add_option("-d", action="store", type=int, default=20000)
+    op.add_option("--batch-size", action="store", type=int, default=256)
+    op.add_option("--num-iters", action="store", type=int, default=1000)
+    op.add_option("--max-processes", action="store", type=int, default=mp.cpu_count())
+    (opts, args) = op.parse_args()
+
+    X, y = make_tfidf_like(opts.n, opts.d)
+    split = int(0.7 * opts.n)
+    X_train, y_train, X_test, y_test = X[:split], y[:split], X[split:], y[split:]
+    Xb = LogisticRegression.append_biases(X_train)
+    check_gradient(Xb[:1000], y_train[:1000])
+
+    w = np.random.RandomState(1).randn(Xb.shape[1]) * 0.01
+    batch = Xb[:opts.batch_size]
+    y_batch = y_train[:opts.batch_size]
+    print "loss+gradient, batch %d:" % opts.batch_size
+    print "  old  %8.1f us" % (timeit(lambda: old_loss(w, batch, y_batch, 1e-3), 200) * 1e6)
+    print "  new  %8.1f us" % (timeit(lambda: LogisticRegression.loss_grad(w, batch, y_batch, 1e-3), 200) * 1e6)
+    print "loss+gradient, full batch %d:" % split
+    print "  old  %8.1f ms" % (timeit(lambda: old_loss(w, Xb, y_train, 1e-3), 5) * 1e3)
+    print "  new  %8.1f ms" % (timeit(lambda: LogisticRegression.loss_grad(w, Xb, y_train, 1e-3), 5) * 1e3)
+
+    clf = LogisticRegression()
+    clf.w = w
+    assert np.allclose(old_predict_proba(w, X_test), clf.predict_proba(X_test, append_bias=True))
+    print "predict_proba, %d rows:" % X_test.shape[0]
+    print "  old          %8.1f ms" % (timeit(lambda: old_predict_proba(w, X_test), 5) * 1e3)
+    print "  new          %8.1f ms" % (timeit(lambda: clf.predict_proba(X_test, append_bias=True), 5) * 1e3)
+    print "  new chunked  %8.1f ms" % (timeit(lambda: clf.predict_proba(X_test, append_bias=True, chunk_size=4096), 5) * 1e3)
+
+    print "batch fetch, %d batches of %d:" % (opts.num_iters, opts.batch_size)
+    for name, batches in [("random", random_batches(Xb, y_train, opts.batch_size)),
+                          ("epoch", iter(EpochBatches(Xb, y_train, opts.batch_size)))]:
+        print "  %-6s %8.1f us" % (name, timeit(lambda: next(batches), opts.num_iters) * 1e6)
+
+    for name, kwargs, num_iters in [
+            ("sgd random", dict(sampling='random'), opts.num_iters),
+            ("sgd epoch", dict(sampling='epoch'), opts.num_iters),
+            ("sgd epoch prefetch", dict(sampling='epoch', prefetch=True), opts.num_iters),
+            ("lbfgs", dict(solver='lbfgs'), 100)]:
+        np.random.seed(0)
+        clf = LogisticRegression()
+        start = time.time()
+        clf.train(X_train, y_train, learning_rate=1.0, reg=1e-3, num_iters=num_iters,
+                  batch_size=opts.batch_size, **kwargs)
+        elapsed = time.time() - start
+        print "%-20s %d iters: %6.2fs, loss %.4f, train acc %.3f, test acc %.3f" % (
+            name, num_iters, elapsed, clf.loss_history[-1],
+            accuracy(clf, X_train, y_train), accuracy(clf, X_test, y_test))
+
+    val = split + (opts.n - split) // 2
+    X_val, y_val = X[split:val], y[split:val]
+    print "optimizers, up to %d iters, early stopping on %d validation rows:" % (
+        opts.num_iters * 10, X_val.shape[0])
+    for optimizer, learning_rate in [("sgd", 1.0), ("momentum", 0.5),
+                                     ("adagrad", 0.1), ("adam", 0.01)]:
+        np.random.seed(0)
+        clf = LogisticRegression()
+        start = time.time()
+        clf.train(X_train, y_train, learning_rate=learning_rate, reg=1e-4,
+                  num_iters=opts.num_iters * 10, batch_size=opts.batch_size,
+                  optimizer=optimizer, X_val=X_val, y_val=y_val)
+        elapsed = time.time() - start
+        print "  %-10s %6d iters: %6.2fs, %6.1f us/iter, val loss %.4f, test acc %.3f" % (
+            optimizer, len(clf.loss_history), elapsed, elapsed / len(clf.loss_history) * 1e6,
+            clf.val_history.min(), accuracy(clf, X[val:], y[val:]))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bench_streaming(tmpdir, X_train, y_train, X_test, y_test, opts)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print "parallel scaling, %d iters:" % opts.num_iters
+    processes = 1
+    while processes <= opts.max_processes:
+        for solver in ("hogwild", "sync"):
+            np.random.seed(0)
+            clf = LogisticRegression()
+            start = time.time()
+            clf.train(X_train, y_train, learning_rate=1.0, reg=1e-3, num_iters=opts.num_iters,
+                      batch_size=opts.batch_size, solver=solver, processes=processes, seed=0)
+            elapsed = time.time() - start
+            print "  %-8s %2d processes: %6.2fs, loss %.4f, test acc %.3f" % (
+                solver, processes, elapsed, np.mean(clf.loss_history[-10:]),
+                accuracy(clf, X_test, y_test))
+        processes *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Stateless feature hashing for text, a replacement for TfidfVectorizer
+when the vocabulary doesn't fit in memory or the data comes as a stream.
+
+Tokens are hashed with crc32 (stable across processes and runs) into
+n_features columns; the high bit of the hash gives the sign, so that
+collisions tend to cancel out instead of accumulating.
+
+    vectorizer = HashingVectorizer(n_features=2 ** 18)
+    X = vectorizer.transform(review_summaries, processes=4)
+    clf.train(X, y)
+"""
+
+import itertools
+import multiprocessing as mp
+import re
+from zlib import crc32
+
+import numpy as np
+from scipy import sparse
+
+TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+
+
+class HashingVectorizer(object):
+    def __init__(self, n_features=2 ** 20, ngram_range=(1, 1), lowercase=True,
+                 token_pattern=TOKEN_PATTERN, alternate_sign=True, binary=False,
+                 norm='l2'):
+        if norm not in ('l2', None):
+            raise ValueError("Unknown norm: %s" % norm)
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.lowercase = lowercase
+        self.token_pattern = token_pattern
+        self.alternate_sign = alternate_sign
+        self.binary = binary
+        self.norm = norm
+        self._token_re = re.compile(token_pattern)
+
+    def params(self):
+        """Constructor arguments, e.g. to store next to a model"""
+        return {k: v for k, v in self.__dict__.iteritems() if not k.startswith('_')}
+
+    def tokens(self, doc):
+        """Words and word n-grams of the document"""
+        if self.lowercase:
+            doc = doc.lower()
+        words = self._token_re.findall(doc)
+        lo, hi = self.ngram_range
+        if (lo, hi) == (1, 1):
+            return words
+        ngrams = []
+        for n in xrange(lo, hi + 1):
+            ngrams.extend(" ".join(words[i:i + n]) for i in xrange(len(words) - n + 1))
+        return ngrams
+
+    def _counts(self, doc):
+        counts = {}
+        for token in self.tokens(doc):
+            if isinstance(token, unicode):
+                token = token.encode('utf-8')
+            h = crc32(token) & 0xffffffff
+            index = h % self.n_features
+            value = -1 if self.alternate_sign and h & 0x80000000 else 1
+            if self.binary:
+                counts[index] = value
+            else:
+                counts[index] = counts.get(index, 0) + value
+        return counts
+
+    def transform(self, docs, batch_size=10000, processes=1):
+        """CSR matrix of the hashed documents"""
+        batches = list(self.transform_batches(docs, batch_size, processes))
+        if not batches:
+            return sparse.csr_matrix((0, self.n_features))
+        return batches[0] if len(batches) == 1 else sparse.vstack(batches, format='csr')
+
+    def transform_batches(self, docs, batch_size=10000, processes=1):
+        """
+        CSR matrices for consecutive batches of batch_size documents of
+        the iterable docs. With processes > 1 the batches are tokenized
+        in a pool; the order is kept and at most a few batches are in
+        flight at a time.
+        """
+        docs = iter(docs)
+        chunks = iter(lambda: list(itertools.islice(docs, batch_size)), [])
+        if processes == 1:
+            for chunk in chunks:
+                yield self._transform_chunk(chunk)
+            return
+        pool = mp.Pool(processes)
+        try:
+            # imap would read the whole iterable ahead, so the pool is fed
+            # a bounded number of chunks at a time.
+            while True:
+                window = list(itertools.islice(chunks, 2 * processes))
+                if not window:
+                    break
+                for X in pool.imap(_transform_chunk, [(self, chunk) for chunk in window]):
+                    yield X
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _transform_chunk(self, docs):
+        indices, data, indptr = [], [], [0]
+        for doc in docs:
+            counts = self._counts(doc)
+            indices.extend(counts.iterkeys())
+            data.extend(counts.itervalues())
+            indptr.append(len(indices))
+        X = sparse.csr_matrix((np.array(data, dtype=np.float64),
+                               np.array(indices, dtype=np.int32),
+                               np.array(indptr, dtype=np.int32)),
+                              shape=(len(docs), self.n_features))
+        X.eliminate_zeros()
+        X.sort_indices()
+        if self.norm == 'l2':
+            _l2_normalize(X)
+        return X
+
+
+def _transform_chunk(args):
+    vectorizer, docs = args
+    return vectorizer._transform_chunk(docs)
+
+
+def _l2_normalize(X):
+    """Scales rows of the CSR matrix X to unit length in place"""
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    norms = np.sqrt(np.bincount(rows, X.data * X.data, minlength=X.shape[0]))
+    X.data /= norms[rows]
@@ -1,16 +1,32 @@
+import functools
+import itertools
+
 import numpy as np
 from scipy import sparse
+from scipy.optimize import fmin_l_bfgs_b
+from scipy.special import expit
+
+import parallel_sgd
+from optimizers import OPTIMIZERS
+from batching import EpochBatches, csr_row_slice, random_batches
 
 
 class LogisticRegression:
     def __init__(self):
         self.w = None
         self.loss_history = None
+        self._batches = None
+        self._batches_src = None
+        self._optimizer = None
+        self.val_history = None
 
     def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
-              batch_size=200, verbose=False):
+              batch_size=200, verbose=False, solver='sgd', sampling='epoch',
+              prefetch=False, processes=None, seed=None, optimizer='sgd',
+              X_val=None, y_val=None, eval_every=100, patience=5, tol=1e-4):
         """
-        Train this classifier using stochastic gradient descent.
+        Train this classifier using stochastic gradient descent (one process
+        or several), or full-batch L-BFGS.
 
         Inputs:
         - X: N x D array of training data. Each training point is a D-dimensional
@@ -21,90 +37,214 @@ class LogisticRegression:
         - num_iters: (integer) number of steps to take when optimizing
         - batch_size: (integer) number of training examples to use at each step.
         - verbose: (boolean) If true, print progress during optimization.
+        - solver: 'sgd' for mini-batch SGD, 'lbfgs' for full-batch L-BFGS
+          (num_iters is then the iterations limit, learning_rate and
+          batch_size are ignored). 'hogwild' and 'sync' run SGD in a pool of
+          processes, see parallel_sgd: lock-free asynchronous updates
+          (num_iters is the total over all processes) or synchronously
+          averaged gradients of a batch split among processes.
+        - sampling: 'epoch' to go through shuffled rows epoch by epoch in
+          contiguous slices, 'random' to sample every batch with replacement.
+          Repeated train() calls on the same X and y continue the same epoch.
+        - prefetch: (boolean) Prepare the next batches in a background thread.
+        - processes: (integer) Pool size for 'hogwild' and 'sync', all CPUs by default.
+        - seed: (integer) Seed of the 'hogwild' and 'sync' batches; 'sync'
+          results are reproducible for the same seed and processes.
+        - optimizer: update rule of 'sgd': plain 'sgd', or 'momentum', 'adagrad',
+          'adam' (see optimizers). For CSR data the latter update lazily, only
+          the weights of the features present in the batch (and the bias);
+          their state is kept between train() calls.
+        - X_val, y_val: validation set for early stopping: every eval_every
+          iterations the validation loss is computed, training stops when it
+          hasn't improved by tol for patience evaluations, and the best
+          weights are restored. The losses are kept in val_history.
 
         Outputs:
-        A list containing the value of the loss function at each training iteration.
+        An array containing the value of the loss function at each training iteration.
         """
-        # Add a column of ones to X for the bias sake.
-        X = LogisticRegression.append_biases(X)
-        num_train, dim = X.shape
+        num_train, dim = X.shape[0], X.shape[1] + 1
         if self.w is None:
             # lazily initialize weights
             self.w = np.random.randn(dim) * 0.01
 
+        if solver == 'lbfgs':
+            return self._train_lbfgs(X, y, reg, num_iters, verbose)
+        if solver in ('hogwild', 'sync'):
+            train = parallel_sgd.train_hogwild if solver == 'hogwild' else parallel_sgd.train_sync
+            loss_grad = functools.partial(LogisticRegression.loss_grad, append_bias=True)
+            self.w, self.loss_history = train(
+                loss_grad, self.w, X, y, learning_rate=learning_rate,
+                reg=reg, num_iters=num_iters, batch_size=batch_size,
+                processes=processes, seed=seed)
+            if verbose:
+                print '%s: %d iterations, loss %f' % (solver, num_iters, self.loss_history[-1])
+            return self
+
+        batches = self._get_batches(X, y, batch_size, sampling, prefetch)
+        if optimizer != 'sgd':
+            opt = self._get_optimizer(optimizer, learning_rate)
+            lazy = sparse.issparse(X)
+            # Squared norm of the regularized weights, kept up to date by
+            # the lazy updates instead of being recomputed every step.
+            w_sq = np.dot(self.w[:-1], self.w[:-1])
+        if X_val is not None:
+            self.val_history = np.empty(num_iters // eval_every)
+            best_loss, best_w, bad_evals = np.inf, self.w.copy(), 0
+
         # Run stochastic gradient descent to optimize W
-        self.loss_history = []
+        self.loss_history = np.empty(num_iters)
         for it in xrange(num_iters):
-            #########################################################################
-            # TODO:                                                                 #
-            # Sample batch_size elements from the training data and their           #
-            # corresponding labels to use in this round of gradient descent.        #
-            # Store the data in X_batch and their corresponding labels in           #
-            # y_batch; after sampling X_batch should have shape (batch_size, dim)   #
-            # and y_batch should have shape (batch_size,)                           #
-            #                                                                       #
-            # Hint: Use np.random.choice to generate indices. Sampling with         #
-            # replacement is faster than sampling without replacement.              #
-            #########################################################################
-            batch_indices = np.random.choice(X.shape[0], size=batch_size, replace=True)
-            X_batch = X[batch_indices]
-            y_batch = y[batch_indices]
-
-            #########################################################################
-            #                       END OF YOUR CODE                                #
-            #########################################################################
-
-            # evaluate loss and gradient
-            loss, gradW = self.loss(X_batch, y_batch, reg)
-            self.loss_history.append(loss)
-            # perform parameter update
-            #########################################################################
-            # TODO:                                                                 #
-            # Update the weights using the gradient and the learning rate.          #
-            #########################################################################
-            self.w = self.w - learning_rate * gradW
+            X_batch, y_batch = next(batches)
+
+            if optimizer == 'sgd':
+                # evaluate loss and gradient
+                loss, gradW = self.loss(X_batch, y_batch, reg, append_bias=True)
+                # perform parameter update
+                #########################################################################
+                # TODO:                                                                 #
+                # Update the weights using the gradient and the learning rate.          #
+                #########################################################################
+                self.w = self.w - learning_rate * gradW
 
-            #########################################################################
-            #                       END OF YOUR CODE                                #
-            #########################################################################
+                #########################################################################
+                #                       END OF YOUR CODE                                #
+                #########################################################################
+            elif lazy:
+                loss, idx, grad = LogisticRegression.sparse_loss_grad(
+                    self.w, X_batch, y_batch, reg, w_sq)
+                old = self.w[idx[:-1]]
+                opt.update(self.w, idx, grad)
+                new = self.w[idx[:-1]]
+                w_sq += np.dot(new, new) - np.dot(old, old)
+            else:
+                loss, gradW = self.loss(X_batch, y_batch, reg, append_bias=True)
+                opt.update(self.w, slice(None), gradW)
+            self.loss_history[it] = loss
 
             if verbose and it % 100 == 0:
                 print 'iteration %d / %d: loss %f' % (it, num_iters, loss)
 
+            if X_val is not None and (it + 1) % eval_every == 0:
+                val_loss = self.val_history[it // eval_every] = self.eval_loss(X_val, y_val)
+                if verbose:
+                    print 'iteration %d / %d: validation loss %f' % (it, num_iters, val_loss)
+                if val_loss < best_loss - tol:
+                    best_loss, best_w, bad_evals = val_loss, self.w.copy(), 0
+                else:
+                    bad_evals += 1
+                    if bad_evals >= patience:
+                        if verbose:
+                            print 'early stopping at iteration %d' % it
+                        self.loss_history = self.loss_history[:it + 1]
+                        self.val_history = self.val_history[:(it + 1) // eval_every]
+                        break
+
+        if X_val is not None and best_loss < np.inf:
+            self.w = best_w
+        return self
+
+    def _get_optimizer(self, name, learning_rate):
+        """The optimizer of the previous train() call if it's the same one"""
+        if name not in OPTIMIZERS:
+            raise ValueError("Unknown optimizer: %s" % name)
+        if (self._optimizer is None or self._optimizer[0] != name or
+                self._optimizer[1].size != self.w.shape[0]):
+            self._optimizer = (name, OPTIMIZERS[name](self.w.shape[0], learning_rate))
+        opt = self._optimizer[1]
+        opt.learning_rate = learning_rate
+        return opt
+
+    def eval_loss(self, X, y, chunk_size=None):
+        """Mean log-loss on X, y without regularization, e.g. for validation"""
+        loss = 0.0
+        for start, stop, z in self._margins(X, True, chunk_size):
+            loss += np.sum(np.logaddexp(0, z) - y[start:stop] * z)
+        return loss / X.shape[0]
+
+    def partial_fit(self, X_batch, y_batch, learning_rate=1e-3, reg=1e-5):
+        """
+        One SGD step on the batch, for data that is only available batch by
+        batch. The loss is appended to loss_history.
+        """
+        if self.w is None:
+            self.w = np.random.randn(X_batch.shape[1] + 1) * 0.01
+        if self.loss_history is None:
+            self.loss_history = []
+        elif not isinstance(self.loss_history, list):
+            self.loss_history = list(self.loss_history)
+        loss, gradW = self.loss(X_batch, y_batch, reg, append_bias=True)
+        self.loss_history.append(loss)
+        self.w = self.w - learning_rate * gradW
+        return self
+
+    def train_stream(self, batches, learning_rate=1e-3, reg=1e-5, num_iters=None,
+                     verbose=False):
+        """
+        SGD over an iterable of (X_batch, y_batch), e.g. streaming.MemmapCSR.batches()
+        or streaming.text_batches(), so the training set never has to fit
+        in memory. Stops after num_iters steps or when batches run out.
+        """
+        self.loss_history = []
+        for it, (X_batch, y_batch) in enumerate(itertools.islice(batches, num_iters)):
+            self.partial_fit(X_batch, y_batch, learning_rate, reg)
+            if verbose and it % 100 == 0:
+                print 'iteration %d: loss %f' % (it, self.loss_history[-1])
+        return self
+
+    def _get_batches(self, X, y, batch_size, sampling, prefetch):
+        params = (batch_size, sampling, prefetch)
+        if (self._batches_src is None or self._batches_src[0] is not X or
+                self._batches_src[1] is not y or self._batches_src[2] != params):
+            if sampling == 'epoch':
+                self._batches = iter(EpochBatches(X, y, batch_size, prefetch=prefetch,
+                                                  seed=np.random.randint(2 ** 31)))
+            elif sampling == 'random':
+                self._batches = random_batches(X, y, batch_size)
+            else:
+                raise ValueError("Unknown sampling: %s" % sampling)
+            self._batches_src = (X, y, params)
+        return self._batches
+
+    def _train_lbfgs(self, X, y, reg, num_iters, verbose):
+        self.loss_history = []
+
+        def f(w):
+            loss, dw = LogisticRegression.loss_grad(w, X, y, reg, append_bias=True)
+            self.loss_history.append(loss)
+            return loss, dw
+
+        self.w, loss, info = fmin_l_bfgs_b(f, self.w, maxiter=num_iters,
+                                           iprint=1 if verbose else -1)
+        if verbose:
+            print 'L-BFGS: %d iterations, loss %f, %s' % (info['nit'], loss, info['task'])
         return self
 
-    def predict_proba(self, X, append_bias=False):
+    def predict_proba(self, X, append_bias=False, chunk_size=None):
         """
         Use the trained weights of this linear classifier to predict probabilities for
         data points.
 
         Inputs:
         - X: N x D array of data. Each row is a D-dimensional point.
-        - append_bias: bool. Whether to append bias before predicting or not.
+        - append_bias: bool. Whether X lacks the bias column; the intercept is
+          then added as a scalar instead of appending a column of ones.
+        - chunk_size: int. If set, X is processed in row blocks of this size,
+          so temporaries never exceed chunk_size rows.
 
         Returns:
         - y_proba: Probabilities of classes for the data in X. y_pred is a 2-dimensional
           array with a shape (N, 2), and each row is a distribution of classes [prob_class_0, prob_class_1].
         """
-        if append_bias:
-            X = LogisticRegression.append_biases(X)
-        ###########################################################################
-        # TODO:                                                                   #
-        # Implement this method. Store the probabilities of classes in y_proba.   #
-        # Hint: It might be helpful to use np.vstack and np.sum                   #
-        ###########################################################################
-        y_pos = self.sigma(X)
-        y_neg = 1 - y_pos
-        y_proba = np.vstack((y_pos, y_neg)).transpose()
-
-        ###########################################################################
-        #                           END OF YOUR CODE                              #
-        ###########################################################################
+        y_proba = np.empty((X.shape[0], 2))
+        for start, stop, z in self._margins(X, append_bias, chunk_size):
+            y_proba[start:stop, 0] = expit(z)
+            y_proba[start:stop, 1] = 1 - y_proba[start:stop, 0]
         return y_proba
 
-    def predict(self, X):
+    def predict(self, X, chunk_size=None):
         """
-        Use the ```predict_proba``` method to predict labels for data points.
+        Predict labels for data points, the same as thresholding
+        ```predict_proba``` at 0.5.
 
         Inputs:
         - X: N x D array of training data. Each column is a D-dimensional point.
@@ -114,38 +254,59 @@ class LogisticRegression:
           array of length N, and each element is an integer giving the predicted
           class.
         """
-
-        ###########################################################################
-        # TODO:                                                                   #
-        # Implement this method. Store the predicted labels in y_pred.            #
-        ###########################################################################
-        y_proba = self.predict_proba(X, append_bias=True)
-        # if argmax == 0: 1, argmax == 1: 0
-        y_pred = 1 - np.argmax(y_proba, axis=1)
-
-        ###########################################################################
-        #                           END OF YOUR CODE                              #
-        ###########################################################################
+        y_pred = np.empty(X.shape[0], dtype=np.int64)
+        for start, stop, z in self._margins(X, True, chunk_size):
+            y_pred[start:stop] = z >= 0
         return y_pred
 
-    def loss(self, X_batch, y_batch, reg):
+    def _margins(self, X, append_bias, chunk_size=None):
+        """Yields (start, stop, X[start:stop] margins) by row blocks"""
+        n = X.shape[0]
+        chunk_size = chunk_size or max(n, 1)
+        for start in xrange(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            if start == 0 and stop == n:
+                X_chunk = X
+            elif sparse.isspmatrix_csr(X):
+                X_chunk = csr_row_slice(X, start, stop)
+            else:
+                X_chunk = X[start:stop]
+            yield start, stop, LogisticRegression.margin(self.w, X_chunk, append_bias)
+
+    def loss(self, X_batch, y_batch, reg, append_bias=False):
         """Logistic Regression loss function
         Inputs:
         - X: N x D array of data. Data are D-dimensional rows
         - y: 1-dimensional array of length N with labels 0-1, for 2 classes
+        - append_bias: bool. Whether X lacks the bias column (see predict_proba)
         Returns:
         a tuple of:
         - loss as single float
         - gradient with respect to weights w; an array of same shape as w
         """
-        dw = np.zeros_like(self.w)  # initialize the gradient as zero
-        # Compute loss and gradient. Your code should not contain python loops.
+        return LogisticRegression.loss_grad(self.w, X_batch, y_batch, reg, append_bias)
 
-        loss = -1.0 * np.sum(
-            y_batch * np.log(self.sigma(X_batch)) +
-            (1 - y_batch) * (1-np.log(self.sigma(X_batch)))
-        )
-        dw = -1.0 * (y_batch - self.sigma(X_batch)) * X_batch
+    @staticmethod
+    def margin(w, X, append_bias=False):
+        """X.dot(w); with append_bias X has no bias column and the bias
+        (last weight) is added as a scalar"""
+        if append_bias:
+            return X.dot(w[:-1]) + w[-1]
+        return X.dot(w)
+
+    @staticmethod
+    def loss_grad(w, X_batch, y_batch, reg, append_bias=False):
+        """loss() for the given weights, the bias is the last one"""
+        # The margin is computed once; log(1 + exp(z)) - y * z is the
+        # negative log-likelihood without overflow for large |z|.
+        z = LogisticRegression.margin(w, X_batch, append_bias)
+        loss = np.sum(np.logaddexp(0, z) - y_batch * z)
+        # Gradient is a single sparse product with the residual.
+        residual = expit(z) - y_batch
+        if append_bias:
+            dw = np.append(X_batch.T.dot(residual), residual.sum())
+        else:
+            dw = X_batch.T.dot(residual)
 
         # Right now the loss is a sum over all training examples, but we want it
         # to be an average instead so we divide by num_train.
@@ -156,14 +317,36 @@ class LogisticRegression:
 
         # Add regularization to the loss and gradient.
         # Note that you have to exclude bias term in regularization.
-        w = self.w[:-1]
+        w = w[:-1]
         loss += reg * np.sum(w * w) / w.shape[0]
         dw[:-1] += reg * 2 * w / w.shape[0]
 
         return loss, dw
 
+    @staticmethod
+    def sparse_loss_grad(w, X_batch, y_batch, reg, w_sq=None):
+        """
+        loss_grad() for a CSR batch without the bias column, with the
+        gradient only for the weights of the features in the batch and the
+        bias: returns (loss, idx, grad), grad being the gradient of w[idx].
+        w_sq is the squared norm of w[:-1], it's computed if not given.
+        """
+        X_batch = X_batch.tocsr()
+        num_train, d = X_batch.shape[0], w.shape[0] - 1
+        z = LogisticRegression.margin(w, X_batch, append_bias=True)
+        residual = (expit(z) - y_batch) / num_train
+        lo, hi = X_batch.indptr[0], X_batch.indptr[-1]
+        cols, inverse = np.unique(X_batch.indices[lo:hi], return_inverse=True)
+        rows = np.repeat(np.arange(num_train), np.diff(X_batch.indptr))
+        grad = np.bincount(inverse, X_batch.data[lo:hi] * residual[rows], minlength=len(cols))
+        grad += reg * 2 * w[cols] / d
+        if w_sq is None:
+            w_sq = np.dot(w[:-1], w[:-1])
+        loss = np.sum(np.logaddexp(0, z) - y_batch * z) / num_train + reg * w_sq / d
+        return loss, np.append(cols, d), np.append(grad, residual.sum())
+
     def sigma(self, X):
-        return 1.0/(1.0 + np.exp(-1.0 * X.dot(self.w)))
+        return expit(LogisticRegression.margin(self.w, X))
 
     @staticmethod
     def append_biases(X):
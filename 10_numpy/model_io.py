@@ -0,0 +1,74 @@
+"""
+Compact binary format for a trained LogisticRegression:
+
+    8 bytes   magic "LRMODEL1"
+    4 bytes   little-endian uint32, length of the header
+    header    JSON: number of weights, their dtype, metadata (e.g. the
+              HashingVectorizer parameters the model was trained with)
+    padding   zeros up to a multiple of 64 bytes
+    weights   float32 little-endian, the bias last
+
+load_model memory-maps the weights, so loading is instant and processes
+serving the same model share its pages.
+"""
+
+from collections import namedtuple
+import json
+import struct
+
+import numpy as np
+
+from hashing import HashingVectorizer
+from logistic_regression import LogisticRegression
+
+MAGIC = "LRMODEL1"
+ALIGN = 64
+DTYPE = '<f4'
+
+Model = namedtuple('Model', ['clf', 'vectorizer', 'metadata'])
+
+
+def save_model(path, clf, vectorizer=None, metadata=None):
+    """Writes clf.w (and the vectorizer parameters, if given) to path"""
+    metadata = dict(metadata or {})
+    if vectorizer is not None:
+        metadata['vectorizer'] = vectorizer.params()
+    w = np.asarray(clf.w, dtype=DTYPE)
+    header = json.dumps({'n_weights': len(w), 'dtype': DTYPE, 'metadata': metadata},
+                        sort_keys=True)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write('\0' * (_weights_offset(len(header)) - f.tell()))
+        f.write(w.tobytes())
+
+
+def _weights_offset(header_size):
+    size = len(MAGIC) + 4 + header_size
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def load_model(path, mmap=True):
+    """Model(clf, vectorizer, metadata) read from path; vectorizer may be None"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a model file" % path)
+        header_size = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(header_size))
+        offset = _weights_offset(header_size)
+        if not mmap:
+            f.seek(offset)
+            w = np.fromfile(f, dtype=header['dtype'], count=header['n_weights'])
+    if mmap:
+        w = np.memmap(path, dtype=header['dtype'], mode='r',
+                      offset=offset, shape=(header['n_weights'],))
+    clf = LogisticRegression()
+    clf.w = w
+    metadata = header['metadata']
+    vectorizer = None
+    if 'vectorizer' in metadata:
+        params = dict(metadata['vectorizer'])
+        params['ngram_range'] = tuple(params['ngram_range'])
+        vectorizer = HashingVectorizer(**params)
+    return Model(clf, vectorizer, metadata)
@@ -0,0 +1,71 @@
+"""
+Per-coordinate SGD update rules with lazy sparse updates: update() gets
+the indices of the weights a batch touches and their gradient, and only
+those weights and their optimizer state change, so a step costs
+O(nnz of the batch) instead of O(n_features). Coordinates a batch doesn't
+touch keep their state (no decay in between), as in "lazy" Adam.
+
+idx passed to update() must not contain duplicates.
+"""
+
+import numpy as np
+
+
+class SGD(object):
+    def __init__(self, size, learning_rate=1e-3):
+        self.size = size
+        self.learning_rate = learning_rate
+
+    def update(self, w, idx, grad):
+        w[idx] -= self.learning_rate * grad
+
+
+class Momentum(SGD):
+    def __init__(self, size, learning_rate=1e-3, momentum=0.9):
+        super(Momentum, self).__init__(size, learning_rate)
+        self.momentum = momentum
+        self.velocity = np.zeros(size)
+
+    def update(self, w, idx, grad):
+        v = self.momentum * self.velocity[idx] + grad
+        self.velocity[idx] = v
+        w[idx] -= self.learning_rate * v
+
+
+class AdaGrad(SGD):
+    def __init__(self, size, learning_rate=1e-1, eps=1e-8):
+        super(AdaGrad, self).__init__(size, learning_rate)
+        self.eps = eps
+        self.grad_sq = np.zeros(size)
+
+    def update(self, w, idx, grad):
+        g2 = self.grad_sq[idx] + grad * grad
+        self.grad_sq[idx] = g2
+        w[idx] -= self.learning_rate * grad / (np.sqrt(g2) + self.eps)
+
+
+class Adam(SGD):
+    def __init__(self, size, learning_rate=1e-3, beta1=0.9, beta2=0.999, eps=1e-8):
+        super(Adam, self).__init__(size, learning_rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.m = np.zeros(size)
+        self.v = np.zeros(size)
+        self.t = 0
+
+    def update(self, w, idx, grad):
+        self.t += 1
+        m = self.beta1 * self.m[idx] + (1 - self.beta1) * grad
+        v = self.beta2 * self.v[idx] + (1 - self.beta2) * grad * grad
+        self.m[idx] = m
+        self.v[idx] = v
+        step = self.learning_rate * np.sqrt(1 - self.beta2 ** self.t) / (1 - self.beta1 ** self.t)
+        w[idx] -= step * m / (np.sqrt(v) + self.eps)
+
+
+OPTIMIZERS = {
+    'momentum': Momentum,
+    'adagrad': AdaGrad,
+    'adam': Adam,
+}
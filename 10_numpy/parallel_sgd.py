@@ -0,0 +1,154 @@
+"""
+Multi-process mini-batch SGD for linear models.
+
+Rows of X are split into contiguous shards, one per worker process of a
+fork()ed pool, so X, y and the weights (a shared RawArray) are inherited
+rather than pickled.
+
+- train_hogwild: every worker runs its own SGD loop over its shard and
+  updates the shared weights without locks (Hogwild). Fast, but the
+  result depends on scheduling.
+- train_sync: every step each worker computes the gradient on its part
+  of the batch, the parent averages them and updates the weights. The
+  batches depend only on the seed, so the result is reproducible.
+
+loss_grad(w, X_batch, y_batch, reg) -> (loss, dw) is the model's loss,
+e.g. LogisticRegression.loss_grad.
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+from scipy import sparse
+
+from batching import EpochBatches, csr_row_slice
+
+# State of a worker process, set up by _init_worker
+_WORKER = {}
+
+
+def _init_worker(loss_grad, shared_w, X, y, shards, params):
+    _WORKER.clear()
+    _WORKER.update(loss_grad=loss_grad, w=np.frombuffer(shared_w), X=X, y=y,
+                   shards=shards, params=params, epochs={})
+
+
+def _split(n, parts):
+    """parts (start, stop) ranges of nearly equal size covering 0..n"""
+    bounds = np.linspace(0, n, parts + 1).astype(int)
+    return [(bounds[i], bounds[i + 1]) for i in xrange(parts) if bounds[i] < bounds[i + 1]]
+
+
+def _rows(X, y, start, stop):
+    if sparse.isspmatrix_csr(X):
+        return csr_row_slice(X, start, stop), y[start:stop]
+    return X[start:stop], y[start:stop]
+
+
+def _shard(i):
+    start, stop = _WORKER['shards'][i]
+    return _rows(_WORKER['X'], _WORKER['y'], start, stop)
+
+
+def _make_pool(loss_grad, w, X, y, shards, params):
+    shared_w = mp.RawArray('d', len(w))
+    w_shared = np.frombuffer(shared_w)
+    w_shared[:] = w
+    X = X.tocsr() if sparse.issparse(X) else X
+    pool = mp.Pool(len(shards), _init_worker, (loss_grad, shared_w, X, y, shards, params))
+    return pool, w_shared
+
+
+def _hogwild_worker(args):
+    shard, num_iters, seed = args
+    params = _WORKER['params']
+    loss_grad, w = _WORKER['loss_grad'], _WORKER['w']
+    X, y = _shard(shard)
+    batches = iter(EpochBatches(X, y, params['batch_size'], seed=seed))
+    losses = np.empty(num_iters)
+    for it in xrange(num_iters):
+        X_batch, y_batch = next(batches)
+        losses[it], dw = loss_grad(w, X_batch, y_batch, params['reg'])
+        # In place and without a lock: concurrent updates may interleave.
+        w -= params['learning_rate'] * dw
+    return losses
+
+
+def train_hogwild(loss_grad, w, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
+                  batch_size=200, processes=None, seed=None):
+    """
+    Asynchronous SGD: num_iters updates of batch_size rows in total,
+    spread over the workers. Returns (w, loss history), where the history
+    is the mean loss of the workers' i-th steps.
+    """
+    processes = processes or mp.cpu_count()
+    shards = _split(X.shape[0], processes)
+    params = dict(learning_rate=learning_rate, reg=reg, batch_size=batch_size)
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    seeds = np.random.RandomState(seed).randint(2 ** 31, size=len(shards))
+    iters = [len(a) for a in np.array_split(np.arange(num_iters), len(shards))]
+
+    pool, w_shared = _make_pool(loss_grad, w, X, y, shards, params)
+    try:
+        losses = pool.map(_hogwild_worker, zip(xrange(len(shards)), iters, seeds))
+    finally:
+        pool.close()
+        pool.join()
+    steps = max(iters)
+    history = np.nanmean([np.append(l, [np.nan] * (steps - len(l))) for l in losses], axis=0)
+    return w_shared.copy(), list(history)
+
+
+def _epoch_rows(shard, epoch):
+    """Shard rows shuffled for the epoch, the same in every worker process"""
+    cached = _WORKER['epochs'].get(shard)
+    if cached is None or cached[0] != epoch:
+        X, y = _shard(shard)
+        perm = np.random.RandomState([_WORKER['params']['seed'], shard, epoch]).permutation(X.shape[0])
+        cached = (epoch, X[perm], y[perm])
+        _WORKER['epochs'][shard] = cached
+    return cached[1], cached[2]
+
+
+def _sync_worker(args):
+    shard, step = args
+    params = _WORKER['params']
+    start, stop = _WORKER['shards'][shard]
+    batch_size = params['shard_batch'][shard]
+    epoch, k = divmod(step, (stop - start + batch_size - 1) // batch_size)
+    X, y = _epoch_rows(shard, epoch)
+    lo, hi = k * batch_size, min((k + 1) * batch_size, X.shape[0])
+    X_batch, y_batch = _rows(X, y, lo, hi)
+    loss, dw = _WORKER['loss_grad'](_WORKER['w'], X_batch, y_batch, params['reg'])
+    return loss * (hi - lo), dw * (hi - lo), hi - lo
+
+
+def train_sync(loss_grad, w, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
+               batch_size=200, processes=None, seed=None):
+    """
+    Synchronous data-parallel SGD: every step the batch_size rows are
+    split among the workers and their gradients are averaged. For a given
+    seed and number of processes the result is deterministic.
+    Returns (w, loss history).
+    """
+    processes = processes or mp.cpu_count()
+    shards = _split(X.shape[0], min(processes, batch_size))
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    shard_batch = [len(a) for a in np.array_split(np.arange(batch_size), len(shards))]
+    params = dict(reg=reg, seed=seed, shard_batch=shard_batch)
+
+    pool, w_shared = _make_pool(loss_grad, w, X, y, shards, params)
+    history = []
+    try:
+        for step in xrange(num_iters):
+            results = pool.map(_sync_worker, [(i, step) for i in xrange(len(shards))])
+            n = sum(r[2] for r in results)
+            history.append(sum(r[0] for r in results) / n)
+            # Workers only read the weights between map() calls.
+            w_shared -= learning_rate * (sum(r[1] for r in results) / n)
+    finally:
+        pool.close()
+        pool.join()
+    return w_shared.copy(), history
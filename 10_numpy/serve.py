@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scoring service for a model saved by model_io.save_model.
+
+The model is loaded (memory-mapped) once at startup. POST /predict takes
+
+    {"texts": ["great taste", ...]}               hashed with the model's vectorizer
+    {"features": [{"12": 0.5, "873": 1.0}, ...]}  column index -> value
+
+and answers in the scoring_api style with the probabilities of class 1:
+
+    {"code": 200, "response": {"proba": [0.93, ...]}}
+
+Concurrent requests are scored together: MicroBatcher collects rows of
+requests arriving within max_wait seconds (up to max_batch rows) and
+computes their margins with a single sparse product.
+
+    python serve.py --model model.lrm -p 8081
+"""
+
+import json
+import logging
+import threading
+import time
+import Queue
+from optparse import OptionParser
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import numpy as np
+from scipy import sparse
+
+from model_io import load_model
+
+OK = 200
+BAD_REQUEST = 400
+NOT_FOUND = 404
+INTERNAL_ERROR = 500
+ERRORS = {
+    BAD_REQUEST: "Bad Request",
+    NOT_FOUND: "Not Found",
+    INTERNAL_ERROR: "Internal Server Error",
+}
+
+
+class MicroBatcher(object):
+    """Scores CSR matrices submitted from many threads in shared batches"""
+    def __init__(self, clf, max_batch=1024, max_wait=0.002):
+        self.clf = clf
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict_proba(self, X):
+        """Probabilities of class 1 for the rows of X, blocks until scored"""
+        done = threading.Event()
+        # [rows, event set when scored, probabilities, exception]
+        item = [X, done, None, None]
+        self._queue.put(item)
+        done.wait()
+        if item[3] is not None:
+            raise item[3]
+        return item[2]
+
+    def _collect(self):
+        items = [self._queue.get()]
+        rows = items[0][0].shape[0]
+        deadline = time.time() + self.max_wait
+        while rows < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                break
+            items.append(item)
+            rows += item[0].shape[0]
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                if len(items) == 1:
+                    X = items[0][0]
+                else:
+                    X = sparse.vstack([item[0] for item in items], format='csr')
+                proba = self.clf.predict_proba(X, append_bias=True)[:, 0]
+                start = 0
+                for item in items:
+                    stop = start + item[0].shape[0]
+                    item[2] = proba[start:stop]
+                    start = stop
+            except Exception, e:
+                logging.exception("Scoring failed: %s" % e)
+                for item in items:
+                    item[3] = e
+            for item in items:
+                item[1].set()
+
+
+def features_matrix(rows, n_features):
+    """CSR matrix of rows given as {column index: value} dicts"""
+    indices, data, indptr = [], [], [0]
+    for row in rows:
+        for index, value in row.iteritems():
+            index = int(index)
+            if not 0 <= index < n_features:
+                raise ValueError("Feature index out of range: %d" % index)
+            indices.append(index)
+            data.append(float(value))
+        indptr.append(len(indices))
+    return sparse.csr_matrix((np.array(data, dtype=np.float64), indices, indptr),
+                             shape=(len(rows), n_features))
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    model = None
+    batcher = None
+
+    def do_POST(self):
+        response, code = {}, OK
+        try:
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        except Exception:
+            request, code = None, BAD_REQUEST
+        if request is not None:
+            if self.path.strip("/") != "predict":
+                code = NOT_FOUND
+            else:
+                response, code = self.predict(request)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        if code == OK:
+            r = {"response": response, "code": code}
+        else:
+            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+        self.wfile.write(json.dumps(r))
+
+    def predict(self, request):
+        n_features = len(self.model.clf.w) - 1
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Request must be an object")
+            if "texts" in request:
+                if self.model.vectorizer is None:
+                    raise ValueError("The model has no vectorizer, send features")
+                texts = request["texts"]
+                if not (isinstance(texts, list) and all(isinstance(t, basestring) for t in texts)):
+                    raise ValueError("texts must be a list of strings")
+                X = self.model.vectorizer.transform(texts)
+            elif "features" in request:
+                rows = request["features"]
+                if not (isinstance(rows, list) and all(isinstance(r, dict) for r in rows)):
+                    raise ValueError("features must be a list of objects")
+                X = features_matrix(rows, n_features)
+            else:
+                raise ValueError("texts or features are required")
+        except (ValueError, TypeError, AttributeError), e:
+            return str(e), BAD_REQUEST
+        try:
+            proba = self.batcher.predict_proba(X)
+        except Exception:
+            return None, INTERNAL_ERROR
+        return {"proba": proba.tolist()}, OK
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=8081)
+    op.add_option("-m", "--model", action="store", help="model file of model_io.save_model")
+    op.add_option("--max-batch", action="store", type=int, default=1024)
+    op.add_option("--max-wait", action="store", type=float, default=0.002,
+                  help="seconds to wait for more requests to score together")
+    op.add_option("-l", "--log", action="store", default=None)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(filename=opts.log, level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    if not opts.model:
+        op.error("--model is required")
+    ScoringHandler.model = load_model(opts.model)
+    ScoringHandler.batcher = MicroBatcher(ScoringHandler.model.clf, opts.max_batch, opts.max_wait)
+    server = ThreadedHTTPServer(("localhost", opts.port), ScoringHandler)
+    logging.info("Starting server at %s" % opts.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
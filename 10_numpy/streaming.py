@@ -0,0 +1,160 @@
+"""
+Out-of-core training data: (X_batch, y_batch) CSR batches read from disk
+with bounded memory, for LogisticRegression.train_stream / partial_fit.
+
+- CSRWriter / MemmapCSR: a CSR matrix kept as raw arrays in a directory,
+  appended batch by batch and read back through np.memmap, so only the
+  rows of the current batch are paged in.
+- text_batches: batches parsed line by line from a text file in the
+  svmlight format ("label index:value ...", 1-based indices), e.g. hashed
+  features.
+"""
+
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from batching import csr_from_arrays
+
+ARRAYS = [
+    ('data', np.float64),
+    ('indices', np.int32),
+    ('indptr', np.int64),
+    ('y', np.float64),
+]
+
+
+class CSRWriter(object):
+    """Appends (X, y) batches with n_features columns to the directory path"""
+    def __init__(self, path, n_features):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.n_features = n_features
+        self.n_rows = 0
+        self.nnz = 0
+        self._files = {name: open(os.path.join(path, name + '.bin'), 'wb') for name, _ in ARRAYS}
+        self._write('indptr', [0])
+
+    def _write(self, name, values):
+        self._files[name].write(np.asarray(values, dtype=dict(ARRAYS)[name]).tobytes())
+
+    def append(self, X, y):
+        X = sparse.csr_matrix(X)
+        if X.shape[1] != self.n_features:
+            raise ValueError("Expected %d features, got %d" % (self.n_features, X.shape[1]))
+        if X.shape[0] != len(y):
+            raise ValueError("X and y have different numbers of rows")
+        if not X.has_sorted_indices:
+            X = X.sorted_indices()
+        lo, hi = X.indptr[0], X.indptr[-1]
+        self._write('data', X.data[lo:hi])
+        self._write('indices', X.indices[lo:hi])
+        self._write('indptr', X.indptr[1:] - lo + self.nnz)
+        self._write('y', y)
+        self.n_rows += X.shape[0]
+        self.nnz += hi - lo
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'n_rows': self.n_rows, 'n_features': self.n_features, 'nnz': self.nnz}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemmapCSR(object):
+    """Read-only memory-mapped view of a matrix written by CSRWriter"""
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.shape = (meta['n_rows'], meta['n_features'])
+        sizes = {'data': meta['nnz'], 'indices': meta['nnz'],
+                 'indptr': meta['n_rows'] + 1, 'y': meta['n_rows']}
+        for name, dtype in ARRAYS:
+            # np.memmap refuses empty files
+            if sizes[name]:
+                array = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype,
+                                  mode='r', shape=(sizes[name],))
+            else:
+                array = np.zeros(0, dtype=dtype)
+            setattr(self, name, array)
+
+    def rows(self, start, stop):
+        """X[start:stop], y[start:stop]; only indptr is read into memory"""
+        indptr = np.asarray(self.indptr[start:stop + 1])
+        lo, hi = indptr[0], indptr[-1]
+        # Offsets within a batch fit the dtype of indices, as scipy expects.
+        X = csr_from_arrays(self.data[lo:hi], self.indices[lo:hi],
+                            (indptr - lo).astype(self.indices.dtype),
+                            (stop - start, self.shape[1]))
+        return X, self.y[start:stop]
+
+    def batches(self, batch_size, shuffle=True, seed=None, epochs=None):
+        """
+        Contiguous batches of batch_size rows, endless unless epochs is
+        given. With shuffle=True the order of batches (not rows) changes
+        every epoch, so reads stay sequential within a batch.
+        """
+        if not self.shape[0]:
+            return
+        rng = np.random.RandomState(seed)
+        starts = np.arange(0, self.shape[0], batch_size)
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            order = rng.permutation(starts) if shuffle else starts
+            for start in order:
+                yield self.rows(start, min(start + batch_size, self.shape[0]))
+            epoch += 1
+
+
+def _csr_batch(labels, data, indices, indptr, n_features):
+    indices = np.array(indices, dtype=np.int32)
+    if len(indices) and (indices.min() < 0 or indices.max() >= n_features):
+        raise ValueError("Feature index out of range 1..%d" % n_features)
+    X = sparse.csr_matrix((data, indices, indptr), shape=(len(labels), n_features),
+                          dtype=np.float64)
+    X.sum_duplicates()
+    return X, np.array(labels, dtype=np.float64)
+
+
+def text_batches(path, n_features, batch_size):
+    """
+    (X, y) batches of a svmlight file with n_features columns, read line
+    by line. Feature indices are 1-based as in svmlight, qid: is ignored.
+    """
+    with open(path) as f:
+        labels, data, indices, indptr = [], [], [], [0]
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            labels.append(float(fields[0]))
+            for field in fields[1:]:
+                index, value = field.split(':')
+                if index == 'qid':
+                    continue
+                indices.append(int(index) - 1)
+                data.append(float(value))
+            indptr.append(len(indices))
+            if len(labels) == batch_size:
+                yield _csr_batch(labels, data, indices, indptr, n_features)
+                labels, data, indices, indptr = [], [], [], [0]
+        if labels:
+            yield _csr_batch(labels, data, indices, indptr, n_features)
+
+
+def write_text(f, X, y):
+    """Appends rows of X, y to the file object f in the svmlight format (1-based indices)"""
+    X = sparse.csr_matrix(X)
+    for i in xrange(X.shape[0]):
+        lo, hi = X.indptr[i], X.indptr[i + 1]
+        f.write("%g %s\n" % (y[i], " ".join(
+            "%d:%r" % (j + 1, v) for j, v in zip(X.indices[lo:hi], X.data[lo:hi]))))
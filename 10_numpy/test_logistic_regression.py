@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from logistic_regression import LogisticRegression
+from optimizers import *
+
+
+def make_data(n_rows=300, n_features=20, seed=0):
+    rng = np.random.RandomState(seed)
+    X = sparse.random(n_rows, n_features, density=0.2, format='csr', random_state=rng)
+    w = rng.randn(n_features)
+    y = (X.dot(w) + 0.1 * rng.randn(n_rows) > 0).astype(np.float64)
+    return X, y
+
+
+class TestLogisticRegression(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_sparse_loss_grad(self):
+        X, y = make_data(n_rows=10)
+        X = sparse.csr_matrix(X[3:8].toarray())
+        y = y[3:8]
+        w = np.random.randn(X.shape[1] + 1)
+        loss, grad = LogisticRegression.loss_grad(w, X, y, 0.1, append_bias=True)
+        sparse_loss, idx, sparse_grad = LogisticRegression.sparse_loss_grad(w, X, y, 0.1)
+        self.assertAlmostEqual(sparse_loss, loss)
+        self.assertTrue(np.allclose(sparse_grad, grad[idx]))
+        # the touched features and the bias
+        self.assertEqual(list(idx), sorted(set(X.indices)) + [X.shape[1]])
+        w_sq = np.dot(w[:-1], w[:-1])
+        self.assertAlmostEqual(LogisticRegression.sparse_loss_grad(w, X, y, 0.1, w_sq)[0], loss)
+
+    def test_sparse_loss_grad_row_slice(self):
+        # a batch whose indptr doesn't start at 0
+        X, y = make_data(n_rows=10)
+        w = np.random.randn(X.shape[1] + 1)
+        batch = X[4:9]
+        batch.indptr = batch.indptr + 3
+        batch.indices = np.append(np.zeros(3, dtype=batch.indices.dtype), batch.indices)
+        batch.data = np.append(np.ones(3), batch.data)
+        loss, grad = LogisticRegression.loss_grad(w, X[4:9], y[4:9], 0.1, append_bias=True)
+        sparse_loss, idx, sparse_grad = LogisticRegression.sparse_loss_grad(w, batch, y[4:9], 0.1)
+        self.assertAlmostEqual(sparse_loss, loss)
+        self.assertTrue(np.allclose(sparse_grad, grad[idx]))
+
+    def check_early_stopping(self, optimizer):
+        X, y = make_data()
+        # labels opposite to the training ones, the validation loss only grows
+        X_val, y_val = X[:100], 1 - y[:100]
+        clf = LogisticRegression()
+        clf.train(X, y, learning_rate=0.5, num_iters=1000, batch_size=50,
+                  optimizer=optimizer, X_val=X_val, y_val=y_val,
+                  eval_every=10, patience=3, tol=0)
+        self.assertLess(len(clf.loss_history), 1000)
+        self.assertEqual(len(clf.loss_history), len(clf.val_history) * 10)
+        self.assertEqual(len(clf.val_history), 4)
+        # the weights of the best evaluation are restored
+        self.assertAlmostEqual(clf.eval_loss(X_val, y_val), clf.val_history.min())
+
+    def test_early_stopping_sgd(self):
+        self.check_early_stopping('sgd')
+
+    def test_early_stopping_lazy(self):
+        self.check_early_stopping('adam')
+
+    def test_no_early_stopping(self):
+        X, y = make_data()
+        clf = LogisticRegression()
+        clf.train(X, y, learning_rate=0.5, num_iters=100, batch_size=50,
+                  X_val=X, y_val=y, eval_every=10, patience=100)
+        self.assertEqual(len(clf.loss_history), 100)
+        self.assertEqual(len(clf.val_history), 10)
+
+    def test_unknown_optimizer(self):
+        X, y = make_data()
+        self.assertRaises(ValueError, LogisticRegression().train, X, y, optimizer='rmsprop')
+
+    def test_optimizers_decrease_loss(self):
+        X, y = make_data()
+        for name in OPTIMIZERS:
+            clf = LogisticRegression()
+            clf.train(X, y, learning_rate=0.1, num_iters=300, batch_size=50, optimizer=name)
+            self.assertLess(clf.eval_loss(X, y), np.log(2) - 0.05, name)
+
+
+class TestOptimizers(unittest.TestCase):
+
+    def test_lazy_update(self):
+        # untouched coordinates keep their weights and state
+        for name, cls in OPTIMIZERS.items():
+            opt = cls(5, learning_rate=0.1)
+            w = np.ones(5)
+            idx = np.array([1, 3])
+            opt.update(w, idx, np.array([1.0, -1.0]))
+            opt.update(w, idx, np.array([1.0, -1.0]))
+            self.assertEqual(list(w[[0, 2, 4]]), [1, 1, 1], name)
+            self.assertTrue(w[1] < 1 < w[3], name)
+
+    def test_dense_and_lazy_agree(self):
+        # updating all the coordinates through idx is the same as a slice
+        grads = np.random.RandomState(0).randn(3, 4)
+        for name, cls in OPTIMIZERS.items():
+            dense, lazy = cls(4), cls(4)
+            w_dense, w_lazy = np.zeros(4), np.zeros(4)
+            for grad in grads:
+                dense.update(w_dense, slice(None), grad)
+                lazy.update(w_lazy, np.arange(4), grad)
+            self.assertTrue(np.allclose(w_dense, w_lazy), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from hashing import HashingVectorizer
+from logistic_regression import LogisticRegression
+from model_io import Model
+from serve import *
+
+
+class Handler(ScoringHandler):
+    """ScoringHandler without a connection, to call predict() directly"""
+    def __init__(self):
+        pass
+
+
+class TestPredict(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        clf = LogisticRegression()
+        clf.w = np.array([1.0, -1.0, 0.5, 0.0, 0.0, 0.0, 0.0, 0.0, 0.2])
+        Handler.model = Model(clf, HashingVectorizer(n_features=8), {})
+        Handler.batcher = MicroBatcher(clf, max_wait=0)
+
+    def predict(self, request):
+        return Handler().predict(request)
+
+    def test_features(self):
+        response, code = self.predict({"features": [{"0": 1.0}, {}]})
+        self.assertEqual(code, OK)
+        self.assertEqual(len(response["proba"]), 2)
+
+    def test_texts(self):
+        response, code = self.predict({"texts": ["great taste", "awful"]})
+        self.assertEqual(code, OK)
+        self.assertEqual(len(response["proba"]), 2)
+
+    def test_bad_requests(self):
+        for request in ([], {}, {"texts": "abc"}, {"texts": [1]},
+                        {"texts": {"abc": 1}}, {"features": "abc"},
+                        {"features": {"0": 1.0}}, {"features": [[0, 1.0]]},
+                        {"features": [{"8": 1.0}]}, {"features": [{"x": 1.0}]}):
+            self.assertEqual(self.predict(request)[1], BAD_REQUEST, request)
+
+
+if __name__ == '__main__':
+    unittest.main()
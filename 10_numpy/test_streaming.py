@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from streaming import *
+
+
+def make_matrix(n_rows=7, n_features=5, seed=0):
+    rng = np.random.RandomState(seed)
+    X = sparse.random(n_rows, n_features, density=0.4, format='csr', random_state=rng)
+    X = sparse.lil_matrix(X)
+    if n_rows >= 3:
+        # the first and the last columns, and an empty row
+        X[0, 0] = 1.5
+        X[1, n_features - 1] = 2.0
+        X[2, :] = 0
+    return sparse.csr_matrix(X), (np.arange(n_rows) % 2).astype(np.float64)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write_text(self, X, y):
+        path = os.path.join(self.tmpdir, 'data.svm')
+        with open(path, 'w') as f:
+            write_text(f, X, y)
+        return path
+
+    def write_csr(self, batches, n_features):
+        path = os.path.join(self.tmpdir, 'csr')
+        with CSRWriter(path, n_features) as writer:
+            for X, y in batches:
+                writer.append(X, y)
+        return MemmapCSR(path)
+
+    def assertBatchesEqual(self, batches, X, y):
+        self.assertEqual(sum(Xb.shape[0] for Xb, _ in batches), X.shape[0])
+        if batches:
+            self.assertTrue(np.array_equal(sparse.vstack([b[0] for b in batches]).toarray(),
+                                           X.toarray()))
+            self.assertTrue(np.array_equal(np.concatenate([b[1] for b in batches]), y))
+
+    def test_text_round_trip(self):
+        X, y = make_matrix()
+        path = self.write_text(X, y)
+        batches = list(text_batches(path, X.shape[1], 3))
+        self.assertEqual([b[0].shape for b in batches], [(3, 5), (3, 5), (1, 5)])
+        self.assertBatchesEqual(batches, X, y)
+
+    def test_text_indices_are_one_based(self):
+        X = sparse.csr_matrix(np.array([[1.0, 0, 2.0]]))
+        path = self.write_text(X, [1])
+        self.assertEqual(open(path).read().split(), ['1', '1:1.0', '3:2.0'])
+
+    def test_text_qid_and_comments(self):
+        path = os.path.join(self.tmpdir, 'qid.svm')
+        with open(path, 'w') as f:
+            f.write("1 qid:3 1:0.5 4:2 # comment\n\n0 qid:3 2:1\n")
+        [(X, y)] = list(text_batches(path, 4, 10))
+        self.assertTrue(np.array_equal(X.toarray(), [[0.5, 0, 0, 2], [0, 1, 0, 0]]))
+        self.assertTrue(np.array_equal(y, [1, 0]))
+
+    def test_text_index_out_of_range(self):
+        path = os.path.join(self.tmpdir, 'bad.svm')
+        with open(path, 'w') as f:
+            f.write("1 5:1\n")
+        with self.assertRaises(ValueError):
+            list(text_batches(path, 4, 10))
+
+    def test_text_empty(self):
+        X, y = make_matrix(n_rows=0)
+        path = self.write_text(X, y)
+        self.assertEqual(list(text_batches(path, X.shape[1], 3)), [])
+
+    def test_memmap_round_trip(self):
+        X, y = make_matrix()
+        mm = self.write_csr([(X[:4], y[:4]), (X[4:], y[4:])], X.shape[1])
+        self.assertEqual(mm.shape, X.shape)
+        Xr, yr = mm.rows(2, 6)
+        self.assertTrue(np.array_equal(Xr.toarray(), X[2:6].toarray()))
+        self.assertTrue(np.array_equal(yr, y[2:6]))
+        batches = list(mm.batches(3, shuffle=False, epochs=1))
+        self.assertBatchesEqual(batches, X, y)
+
+    def test_memmap_shuffled_epochs(self):
+        X, y = make_matrix()
+        mm = self.write_csr([(X, y)], X.shape[1])
+        batches = list(mm.batches(3, seed=0, epochs=2))
+        self.assertEqual(len(batches), 6)
+        # every epoch has all the rows
+        for epoch in (batches[:3], batches[3:]):
+            rows = sorted(tuple(np.append(b[0].toarray()[i], b[1][i]))
+                          for b in epoch for i in xrange(b[0].shape[0]))
+            expected = sorted(tuple(np.append(X.toarray()[i], y[i])) for i in xrange(X.shape[0]))
+            self.assertEqual(rows, expected)
+
+    def test_memmap_empty(self):
+        X, y = make_matrix(n_rows=0)
+        mm = self.write_csr([(X, y)], X.shape[1])
+        self.assertEqual(mm.shape, (0, X.shape[1]))
+        self.assertEqual(mm.rows(0, 0)[0].shape, (0, X.shape[1]))
+        self.assertEqual(list(mm.batches(3)), [])
+
+    def test_writer_checks_features(self):
+        X, y = make_matrix()
+        with CSRWriter(os.path.join(self.tmpdir, 'csr'), X.shape[1] + 1) as writer:
+            self.assertRaises(ValueError, writer.append, X, y)
+
+
+if __name__ == '__main__':
+    unittest.main()
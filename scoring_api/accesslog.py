@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import Queue
+import random
+import sys
+import threading
+
+_STOP = object()
+
+
+class AccessLogWriter(object):
+    """
+    Structured access log: one JSON object per line.
+
+    Request handlers only enqueue records, serialization and writing
+    are done by a background thread. With sample_rate < 1.0 only a
+    random share of the records is written (forced ones always are).
+    When the queue is full new records are dropped and counted.
+    """
+    def __init__(self, stream, sample_rate=1.0, queue_size=10000, dumps=json.dumps):
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.dumps = dumps
+        self.dropped = 0
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="access-log")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def open(cls, path, **kwargs):
+        stream = sys.stdout if path == "-" else open(path, "a")
+        return cls(stream, **kwargs)
+
+    def write(self, record, force=False):
+        if not force and random.random() >= self.sample_rate:
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            try:
+                self.stream.write(self.dumps(record) + "\n")
+            except Exception as exc:
+                logging.error("Failed to write access log record: %s", exc)
+            if self._queue.empty():
+                self.stream.flush()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+        self.stream.flush()
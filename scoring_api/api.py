@@ -2,19 +2,31 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import hashlib
+import hmac
+import threading
+import time
 import uuid
 from optparse import OptionParser
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
+from accesslog import AccessLogWriter
+from metrics import Metrics, timed
 import scoring
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
 ADMIN_SALT = "42"
+AUTH_CACHE_SIZE = 10000
+BATCH_MAX_SIZE = 1000
 OK = 200
 BAD_REQUEST = 400
 FORBIDDEN = 403
@@ -36,6 +48,12 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
 }
+JSON_CODECS = {
+    "json": (json.loads, json.dumps),
+}
+if ujson is not None:
+    JSON_CODECS["ujson"] = (ujson.loads, ujson.dumps)
+DEFAULT_JSON_CODEC = "ujson" if ujson is not None else "json"
 
 
 class ValidationError(Exception):
@@ -182,10 +200,12 @@ class ClientsInterestsRequest(BaseRequest):
     def _fill_context(self, ctx):
         ctx['nclients'] = len(self.client_ids)
 
-    def get_result(self, ctx, store, is_admin=False):
+    def get_result(self, ctx, store, is_admin=False, interests=None):
         self._fill_context(ctx)
-        return {clid: scoring.get_interests(store, clid)
-                for clid in self.client_ids}
+        if interests is None:
+            with timed(ctx, "store"):
+                interests = scoring.get_interests_many(store, self.client_ids)
+        return {clid: interests[clid] for clid in self.client_ids}
 
 
 class OnlineScoreRequest(BaseRequest):
@@ -211,8 +231,8 @@ class OnlineScoreRequest(BaseRequest):
         self._fill_context(ctx)
         if is_admin:
             return {"score": 42}
-        return {
-            "score": scoring.get_score(
+        with timed(ctx, "score"):
+            score = scoring.get_score(
                 store,
                 self.phone,
                 self.email,
@@ -221,7 +241,7 @@ class OnlineScoreRequest(BaseRequest):
                 self.first_name,
                 self.last_name
             )
-        }
+        return {"score": score}
 
 
 class MethodRequest(BaseRequest):
@@ -236,69 +256,246 @@ class MethodRequest(BaseRequest):
         return self.login == ADMIN_LOGIN
 
 
+class AdminDigest(object):
+    """Admin token digest, computed once per hour and rotated on expiry"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._digest = None
+        self._expires = 0
+
+    def get(self):
+        if time.time() >= self._expires:
+            with self._lock:
+                if time.time() >= self._expires:
+                    self._rotate()
+        return self._digest
+
+    def _rotate(self):
+        now = datetime.now()
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        self._digest = hashlib.sha512(hour.strftime("%Y%m%d%H") + ADMIN_SALT).hexdigest()
+        self._expires = time.mktime((hour + timedelta(hours=1)).timetuple())
+
+
+class TokenCache(object):
+    """Bounded LRU set of already verified (account, login, token) triples"""
+    def __init__(self, maxsize=AUTH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def __contains__(self, key):
+        with self._lock:
+            try:
+                self._cache[key] = self._cache.pop(key)
+            except KeyError:
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._cache)
+
+    def add(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = True
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+admin_digest = AdminDigest()
+token_cache = TokenCache()
+
+
+def _digest_equal(digest, token):
+    if isinstance(token, unicode):
+        try:
+            token = token.encode("ascii")
+        except UnicodeError:
+            return False
+    if not isinstance(token, str):
+        return False
+    return hmac.compare_digest(digest, token)
+
+
 def check_auth(request):
     if request.is_admin:
-        digest = hashlib.sha512(datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).hexdigest()
-    else:
-        digest = hashlib.sha512(request.account + request.login + SALT).hexdigest()
-    if digest == request.token:
+        return _digest_equal(admin_digest.get(), request.token)
+    key = (request.account, request.login, request.token)
+    if key in token_cache:
+        return True
+    digest = hashlib.sha512(request.account + request.login + SALT).hexdigest()
+    if _digest_equal(digest, request.token):
+        token_cache.add(key)
         return True
     return False
 
 
-def method_handler(request, ctx, store):
-    request_map = {
-        'online_score': OnlineScoreRequest,
-        'clients_interests': ClientsInterestsRequest,
-    }
-    method_request = MethodRequest(request['body'])
+REQUEST_MAP = {
+    'online_score': OnlineScoreRequest,
+    'clients_interests': ClientsInterestsRequest,
+}
+
+
+def _prepare_request(body, ctx, auth=check_auth):
+    """
+    Validate and authenticate a single method request.
+    @:returns ((method_request, req), None, OK) or (None, error, code)
+    """
+    if not isinstance(body, dict):
+        return None, "Method request should be an object", INVALID_REQUEST
+    method_request = MethodRequest(body)
     try:
-        method_request.validate_fields()
+        with timed(ctx, "validate"):
+            method_request.validate_fields()
     except ValidationError, e:
-        return e.message, INVALID_REQUEST
+        return None, e.message, INVALID_REQUEST
 
-    if not check_auth(method_request):
-        return None, FORBIDDEN
+    with timed(ctx, "auth"):
+        authorized = auth(method_request)
+    if not authorized:
+        return None, None, FORBIDDEN
 
-    if method_request.method not in request_map:
+    if method_request.method not in REQUEST_MAP:
         err = "Unknown method %s, choose any of: %s" % (method_request.method,
-                                                        request_map.keys())
-        return err, INVALID_REQUEST
+                                                        REQUEST_MAP.keys())
+        return None, err, INVALID_REQUEST
+    # a metrics label: only known methods of authenticated requests
+    ctx['method'] = method_request.method
 
-    req = request_map[method_request.method](method_request.arguments)
+    req = REQUEST_MAP[method_request.method](method_request.arguments)
     try:
-        req.validate_fields()
+        with timed(ctx, "validate"):
+            req.validate_fields()
     except ValidationError, e:
-        return e.message, INVALID_REQUEST
+        return None, e.message, INVALID_REQUEST
+    return (method_request, req), None, OK
+
+
+def method_handler(request, ctx, store):
+    prepared, err, code = _prepare_request(request['body'], ctx)
+    if code != OK:
+        return err, code
+    method_request, req = prepared
 
     result = req.get_result(ctx, store, is_admin=method_request.is_admin)
 
     return result, OK
 
 
+def batch_handler(request, ctx, store):
+    items = request['body']
+    if not isinstance(items, list) or not items:
+        return "Batch should be a non-empty list of method requests", INVALID_REQUEST
+    if len(items) > BATCH_MAX_SIZE:
+        return "Batch is limited to %d requests" % BATCH_MAX_SIZE, INVALID_REQUEST
+
+    # authenticate every distinct credentials triple only once
+    auth_results = {}
+
+    def auth(method_request):
+        key = (method_request.account, method_request.login, method_request.token)
+        if key not in auth_results:
+            auth_results[key] = check_auth(method_request)
+        return auth_results[key]
+
+    item_ctxs = [{} for _ in items]
+    prepared = [_prepare_request(body, item_ctx, auth)
+                for body, item_ctx in zip(items, item_ctxs)]
+
+    # one bulk store lookup for all the client ids in the batch
+    client_ids = set()
+    for p, _, code in prepared:
+        if code == OK and isinstance(p[1], ClientsInterestsRequest):
+            client_ids.update(p[1].client_ids)
+    interests = {}
+    if client_ids:
+        try:
+            with timed(ctx, "store"):
+                interests = scoring.get_interests_many(store, client_ids)
+        except Exception, e:
+            # only the clients_interests items depend on the lookup
+            logging.exception("Store lookup failed for batch: %s" % e)
+            interests = None
+
+    results = []
+    ctx['nrequests'] = len(items)
+    ctx['items'] = item_ctxs
+    for (p, response, code), item_ctx in zip(prepared, item_ctxs):
+        if code == OK:
+            method_request, req = p
+            kwargs = {"is_admin": method_request.is_admin}
+            if isinstance(req, ClientsInterestsRequest):
+                if interests is None:
+                    item_ctx["code"] = INTERNAL_ERROR
+                    results.append(build_response(None, INTERNAL_ERROR))
+                    continue
+                kwargs["interests"] = interests
+            try:
+                response = req.get_result(item_ctx, store, **kwargs)
+            except Exception, e:
+                logging.exception("Unexpected error in batch item: %s" % e)
+                response, code = None, INTERNAL_ERROR
+        item_ctx["code"] = code
+        results.append(build_response(response, code))
+    return results, OK
+
+
+def build_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
-        "method": method_handler
+        "method": method_handler,
+        "batch": batch_handler,
     }
     store = None
+    access_log = None
+    metrics = Metrics()
+    json_codec = JSON_CODECS[DEFAULT_JSON_CODEC]
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def do_GET(self):
+        start = time.time()
+        path = self.path.strip("/")
+        if path == "metrics":
+            code, content_type, body = OK, "text/plain; version=0.0.4", self.metrics.render()
+        else:
+            code, content_type = NOT_FOUND, "application/json"
+            body = self.json_codec[1](build_response(None, code))
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(body)
+        self.metrics.observe(path if code == OK else "unknown", "", code, time.time() - start)
+
     def do_POST(self):
+        start = time.time()
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
+        route = "unknown"
+        loads, dumps = self.json_codec
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            request = loads(data_string)
         except:
             code = BAD_REQUEST
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
+            logging.debug("%s: %s %s", self.path, data_string, context["request_id"])
             if path in self.router:
+                route = path
                 try:
                     response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
                 except Exception, e:
@@ -310,13 +507,16 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+        r = build_response(response, code)
         context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r))
+        if self.access_log is not None:
+            context["path"] = self.path
+            self.access_log.write(context, force=code >= INTERNAL_ERROR)
+        else:
+            logging.info(context)
+        self.wfile.write(dumps(r))
+        self.metrics.observe(route, context.get("method", "unknown"), code,
+                             time.time() - start, context.get("timings"))
         return
 
 
@@ -324,9 +524,20 @@ if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--access-log", action="store", default=None,
+                  help="structured access log file ('-' for stdout)")
+    op.add_option("--access-log-sample", action="store", type=float, default=1.0,
+                  help="share of requests written to the access log")
+    op.add_option("--json", action="store", default=DEFAULT_JSON_CODEC,
+                  choices=sorted(JSON_CODECS.keys()))
     (opts, args) = op.parse_args()
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    MainHTTPHandler.json_codec = JSON_CODECS[opts.json]
+    if opts.access_log:
+        MainHTTPHandler.access_log = AccessLogWriter.open(opts.access_log,
+                                                          sample_rate=opts.access_log_sample,
+                                                          dumps=JSON_CODECS[opts.json][1])
     server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
     logging.info("Starting server at %s" % opts.port)
     try:
@@ -334,3 +545,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         pass
     server.server_close()
+    if MainHTTPHandler.access_log is not None:
+        MainHTTPHandler.access_log.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CPU time spent by MainHTTPHandler.do_POST per request with the
+old-style logging (raw body + context via logging.info, stdlib json)
+versus the sampled asynchronous access log and the fastest json codec.
+
+    python bench_do_post.py -n 20000
+"""
+
+import hashlib
+import json
+import logging
+import time
+from optparse import OptionParser
+from StringIO import StringIO
+
+import api
+from accesslog import AccessLogWriter
+
+
+class NullStream(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BenchHandler(api.MainHTTPHandler):
+    """Handler that runs without a socket"""
+    def __init__(self, body, path="/method"):
+        self.rfile = StringIO(body)
+        self.wfile = StringIO()
+        self.headers = {"Content-Length": str(len(body))}
+        self.path = path
+        self.request_version = "HTTP/1.1"
+        self.client_address = ("127.0.0.1", 0)
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+def make_body():
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+               "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru",
+                             "first_name": "a", "last_name": "b",
+                             "birthday": "01.01.2000", "gender": 1}}
+    request["token"] = hashlib.sha512(request["account"] + request["login"] + api.SALT).hexdigest()
+    return json.dumps(request)
+
+
+def run(body, n):
+    start = time.clock()
+    for _ in xrange(n):
+        BenchHandler(body).do_POST()
+    return (time.clock() - start) / n
+
+
+def main():
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=20000)
+    op.add_option("--sample", action="store", type=float, default=0.01)
+    (opts, args) = op.parse_args()
+
+    # old behaviour: raw body and context are both logged per request
+    handler = logging.StreamHandler(NullStream())
+    handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname).1s %(message)s'))
+    logging.getLogger().addHandler(handler)
+    body = make_body()
+
+    results = []
+    api.MainHTTPHandler.json_codec = api.JSON_CODECS["json"]
+    api.MainHTTPHandler.access_log = None
+    logging.getLogger().setLevel(logging.DEBUG)
+    results.append(("logging, json", run(body, opts.n)))
+    logging.getLogger().setLevel(logging.INFO)
+
+    for codec in sorted(api.JSON_CODECS):
+        api.MainHTTPHandler.json_codec = api.JSON_CODECS[codec]
+        writer = AccessLogWriter(NullStream(), sample_rate=opts.sample,
+                                 dumps=api.JSON_CODECS[codec][1])
+        api.MainHTTPHandler.access_log = writer
+        results.append(("access log %.0f%%, %s" % (opts.sample * 100, codec), run(body, opts.n)))
+        writer.close()
+
+    base = results[0][1]
+    for name, cpu in results:
+        print "%-30s %8.1f us/request  saved %5.1f us" % (name, cpu * 1e6, (base - cpu) * 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load generator for scoring_api.
+
+Starts the server in-process on top of FakeStore (unless --url is given),
+fires a mix of online_score / clients_interests / admin requests from
+--concurrency client threads and reports throughput and latency
+percentiles per request kind.
+
+    python loadtest.py -n 5000 -c 8 --store-latency 0.002 --store-failure-rate 0.01
+"""
+
+from collections import defaultdict
+from datetime import datetime
+import hashlib
+import httplib
+import json
+import logging
+import random
+import threading
+import time
+import urlparse
+from optparse import OptionParser
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+import api
+
+MIX = {
+    "online_score": 6,
+    "clients_interests": 3,
+    "admin": 1,
+}
+
+
+class StoreError(IOError):
+    pass
+
+
+class FakeStore(object):
+    """
+    In-memory store with injectable per-call latency and failure rate.
+    get_many() costs a single round trip, like a real bulk lookup.
+    """
+    def __init__(self, data=None, latency=0.0, failure_rate=0.0, seed=None):
+        self.data = data if data is not None else {}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def _roundtrip(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise StoreError("Fake store failure")
+
+    def get(self, key):
+        self._roundtrip()
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        self._roundtrip()
+        return [self.data.get(k) for k in keys]
+
+    @classmethod
+    def with_interests(cls, nclients, **kwargs):
+        rnd = random.Random(kwargs.get("seed"))
+        data = {"i:%s" % cid: json.dumps(rnd.sample(api.scoring.INTERESTS, 2))
+                for cid in xrange(nclients)}
+        return cls(data, **kwargs)
+
+
+class LoadTestHTTPServer(HTTPServer):
+    request_queue_size = 128
+
+
+class ThreadedHTTPServer(ThreadingMixIn, LoadTestHTTPServer):
+    daemon_threads = True
+
+
+class QuietHandler(api.MainHTTPHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(store, threaded=True):
+    class Handler(QuietHandler):
+        pass
+    Handler.store = store
+    server_cls = ThreadedHTTPServer if threaded else LoadTestHTTPServer
+    server = server_cls(("localhost", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _token(account, login):
+    if login == api.ADMIN_LOGIN:
+        return hashlib.sha512(datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).hexdigest()
+    return hashlib.sha512(account + login + api.SALT).hexdigest()
+
+
+def make_request(kind, rnd, nclients):
+    if kind == "clients_interests":
+        method = kind
+        arguments = {"client_ids": rnd.sample(xrange(nclients), rnd.randint(1, min(10, nclients)))}
+    else:
+        method = "online_score"
+        arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru",
+                     "first_name": "a", "last_name": "b"}
+    login = api.ADMIN_LOGIN if kind == "admin" else "user%d" % rnd.randint(0, 99)
+    account = "horns&hoofs"
+    return {"account": account, "login": login, "token": _token(account, login),
+            "method": method, "arguments": arguments}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    idx = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+def client(host, port, requests, latencies, codes, lock):
+    for kind, body in requests:
+        data = json.dumps(body)
+        start = time.time()
+        conn = httplib.HTTPConnection(host, port)
+        try:
+            conn.request("POST", "/method", data, {"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            code = json.loads(resp.read())["code"]
+        except Exception as exc:
+            logging.error("Request failed: %s", exc)
+            code = "conn_error"
+        finally:
+            conn.close()
+        elapsed = time.time() - start
+        with lock:
+            latencies[kind].append(elapsed)
+            codes[code] += 1
+
+
+def run(host, port, nrequests, concurrency, nclients, mix=MIX, seed=None):
+    rnd = random.Random(seed)
+    kinds = [k for k, w in sorted(mix.items()) for _ in xrange(w)]
+    requests = [(kind, make_request(kind, rnd, nclients))
+                for kind in (rnd.choice(kinds) for _ in xrange(nrequests))]
+    latencies = defaultdict(list)
+    codes = defaultdict(int)
+    lock = threading.Lock()
+    threads = [threading.Thread(target=client,
+                                args=(host, port, requests[i::concurrency], latencies, codes, lock))
+               for i in xrange(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - start, latencies, codes
+
+
+def report(elapsed, latencies, codes):
+    total = sum(len(v) for v in latencies.values())
+    print "%d requests in %.2fs: %.1f req/s" % (total, elapsed, total / elapsed)
+    print "codes: %s" % ", ".join("%s=%d" % kv for kv in sorted(codes.items()))
+    print "%-20s %7s %8s %8s %8s %8s" % ("kind", "count", "p50 ms", "p90 ms", "p99 ms", "max ms")
+    rows = sorted(latencies.items())
+    rows.append(("all", [v for values in latencies.values() for v in values]))
+    for kind, values in rows:
+        if not values:
+            continue
+        values.sort()
+        print "%-20s %7d %8.2f %8.2f %8.2f %8.2f" % (
+            kind, len(values),
+            percentile(values, 50) * 1000, percentile(values, 90) * 1000,
+            percentile(values, 99) * 1000, values[-1] * 1000)
+
+
+def main():
+    op = OptionParser()
+    op.add_option("-n", "--requests", action="store", type=int, default=2000)
+    op.add_option("-c", "--concurrency", action="store", type=int, default=4)
+    op.add_option("--url", action="store", default=None,
+                  help="target a running server instead of starting one")
+    op.add_option("--clients", action="store", type=int, default=1000,
+                  help="number of client ids with stored interests")
+    op.add_option("--store-latency", action="store", type=float, default=0.0)
+    op.add_option("--store-failure-rate", action="store", type=float, default=0.0)
+    op.add_option("--single-threaded", action="store_true", default=False,
+                  help="serve with plain HTTPServer, as api.py does")
+    op.add_option("--seed", action="store", type=int, default=None)
+    op.add_option("-l", "--log", action="store", default=None)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(filename=opts.log, level=logging.ERROR,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+
+    if opts.clients < 1:
+        op.error("--clients must be positive")
+
+    server = None
+    if opts.url:
+        url = urlparse.urlparse(opts.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        store = FakeStore.with_interests(opts.clients,
+                                         latency=opts.store_latency,
+                                         failure_rate=opts.store_failure_rate,
+                                         seed=opts.seed)
+        server = start_server(store, threaded=not opts.single_threaded)
+        host, port = server.server_address
+    try:
+        report(*run(host, port, opts.requests, opts.concurrency, opts.clients, seed=opts.seed))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+from collections import defaultdict
+from contextlib import contextmanager
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = "scoring_api"
+
+
+@contextmanager
+def timed(ctx, stage):
+    """Add the time spent in the block to ctx['timings'][stage]"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings = ctx.setdefault("timings", {})
+        timings[stage] = timings.get(stage, 0.0) + time.time() - start
+
+
+class Histogram(object):
+    """Fixed-bucket histogram, the bucket is found outside of any lock"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, idx, value):
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, cnt in zip(self.buckets + (float("inf"),), self.counts):
+            total += cnt
+            yield le, total
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join('%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items())) + "}"
+
+
+def _le(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Metrics(object):
+    """
+    In-process request counters and latency histograms
+    per (route, method, code), plus per-stage latency histograms.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = defaultdict(lambda: Histogram(self.buckets))
+        self._stages = defaultdict(lambda: Histogram(self.buckets))
+
+    def observe(self, route, method, code, duration, timings=None):
+        key = (route, method or "", code)
+        idx = bisect.bisect_left(self.buckets, duration)
+        stages = [(stage, bisect.bisect_left(self.buckets, t), t)
+                  for stage, t in (timings or {}).items()]
+        with self._lock:
+            self._requests[key].add(idx, duration)
+            for stage, stage_idx, t in stages:
+                self._stages[(route, method or "", stage)].add(stage_idx, t)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            requests = [(k, list(h.cumulative()), h.sum, h.count)
+                        for k, h in sorted(self._requests.items())]
+            stages = [(k, list(h.cumulative()), h.sum, h.count)
+                      for k, h in sorted(self._stages.items())]
+        lines = [
+            "# HELP %s_requests_total Requests handled." % PREFIX,
+            "# TYPE %s_requests_total counter" % PREFIX,
+        ]
+        for (route, method, code), _, _, count in requests:
+            lines.append("%s_requests_total%s %d" % (
+                PREFIX, _labels(route=route, method=method, code=code), count))
+        lines.extend(self._render_histograms(
+            "request_duration_seconds", "Request latency.",
+            [(dict(route=r, method=m, code=c), cum, s, n) for (r, m, c), cum, s, n in requests]))
+        lines.extend(self._render_histograms(
+            "stage_duration_seconds", "Latency of request handling stages.",
+            [(dict(route=r, method=m, stage=st), cum, s, n) for (r, m, st), cum, s, n in stages]))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(name, help, series):
+        name = "%s_%s" % (PREFIX, name)
+        lines = ["# HELP %s %s" % (name, help), "# TYPE %s histogram" % name]
+        for labels, cumulative, total, count in series:
+            for le, cnt in cumulative:
+                lines.append("%s_bucket%s %d" % (name, _labels(le=_le(le), **labels), cnt))
+            lines.append("%s_sum%s %r" % (name, _labels(**labels), total))
+            lines.append("%s_count%s %d" % (name, _labels(**labels), count))
+        return lines
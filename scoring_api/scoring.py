@@ -1,5 +1,8 @@
+import json
 import random
 
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
 
 def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
     score = 0
@@ -14,6 +17,19 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
     return score
 
 
+def _interests_key(cid):
+    return "i:%s" % cid
+
+
 def get_interests(store, cid):
-    interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
-    return random.sample(interests, 2)
+    r = store.get(_interests_key(cid)) if store else None
+    return json.loads(r) if r else random.sample(INTERESTS, 2)
+
+
+def get_interests_many(store, cids):
+    cids = list(cids)
+    if not store:
+        return {cid: get_interests(store, cid) for cid in cids}
+    values = store.get_many([_interests_key(cid) for cid in cids])
+    return {cid: json.loads(r) if r else random.sample(INTERESTS, 2)
+            for cid, r in zip(cids, values)}
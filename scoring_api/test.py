@@ -1,9 +1,17 @@
 import hashlib
 import datetime
 import functools
+import httplib
+import json
+import logging
+import random
 import unittest
+from StringIO import StringIO
 
 import api
+from accesslog import AccessLogWriter
+from metrics import Metrics
+from loadtest import FakeStore, make_request, start_server
 
 
 def cases(cases):
@@ -46,6 +54,30 @@ class TestSuite(unittest.TestCase):
         _, code = self.get_response(request)
         self.assertEqual(api.FORBIDDEN, code)
 
+    def test_auth_cache(self):
+        api.token_cache.clear()
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"first_name": "a", "last_name": "b"}}
+        self.set_valid_auth(request)
+        _, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertIn(("horns&hoofs", "h&f", request["token"]), api.token_cache)
+        request["token"] = "0" * len(request["token"])
+        _, code = self.get_response(request)
+        self.assertEqual(api.FORBIDDEN, code)
+        self.assertEqual(1, len(api.token_cache))
+
+    def test_token_cache_eviction(self):
+        cache = api.TokenCache(maxsize=2)
+        cache.add(1)
+        cache.add(2)
+        self.assertIn(1, cache)
+        cache.add(3)
+        self.assertEqual(2, len(cache))
+        self.assertNotIn(2, cache)
+        self.assertIn(1, cache)
+        self.assertIn(3, cache)
+
     @cases([
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score"},
         {"account": "horns&hoofs", "login": "h&f", "arguments": {}},
@@ -137,6 +169,133 @@ class TestSuite(unittest.TestCase):
                         for v in response.values()))
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
+    def get_batch_response(self, requests):
+        return api.batch_handler({"body": requests, "headers": self.headers}, self.context, self.settings)
+
+    @cases([[], {}, [{}] * (api.BATCH_MAX_SIZE + 1)])
+    def test_invalid_batch(self, requests):
+        response, code = self.get_batch_response(requests)
+        self.assertEqual(api.INVALID_REQUEST, code)
+        self.assertTrue(len(response))
+
+    def test_batch(self):
+        requests = [
+            {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+             "arguments": {"client_ids": [1, 2]}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+             "arguments": {"client_ids": [2, 3]}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"first_name": "a", "last_name": "b"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": {}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "",
+             "arguments": {"first_name": "a", "last_name": "b"}},
+            "not a request",
+        ]
+        for request in requests[:4]:
+            self.set_valid_auth(request)
+        response, code = self.get_batch_response(requests)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.OK, api.OK, api.INVALID_REQUEST, api.FORBIDDEN, api.INVALID_REQUEST],
+                         [r["code"] for r in response])
+        self.assertEqual([1, 2], sorted(response[0]["response"].keys()))
+        self.assertEqual(response[0]["response"][2], response[1]["response"][2])
+        self.assertEqual(0.5, response[2]["response"]["score"])
+        self.assertTrue(all("error" in r for r in response[3:]))
+        self.assertEqual(len(requests), self.context["nrequests"])
+        self.assertEqual(2, self.context["items"][0]["nclients"])
+
+    def test_access_log_sampling(self):
+        stream = StringIO()
+        writer = AccessLogWriter(stream, sample_rate=0.0)
+        self.assertFalse(writer.write({"code": 200}))
+        self.assertTrue(writer.write({"code": 500}, force=True))
+        writer.close()
+        self.assertEqual([{"code": 500}], [json.loads(l) for l in stream.getvalue().splitlines()])
+
+    def test_stage_timings(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(request)
+        _, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual("clients_interests", self.context["method"])
+        self.assertEqual(["auth", "store", "validate"], sorted(self.context["timings"]))
+
+    @cases([
+        {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}},
+        {"account": "horns&hoofs", "login": "h&f", "method": "no_such_method", "arguments": {}},
+    ])
+    def test_no_method_label_without_auth(self, request):
+        if request["method"] == "no_such_method":
+            self.set_valid_auth(request)
+        self.context = {}
+        self.get_response(request)
+        self.assertNotIn("method", self.context)
+
+    def test_metrics_render(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe("method", "online_score", 200, 0.05, {"auth": 0.01})
+        metrics.observe("method", "online_score", 200, 0.5)
+        text = metrics.render()
+        labels = 'code="200",method="online_score",route="method"'
+        self.assertIn('scoring_api_requests_total{%s} 2' % labels, text)
+        self.assertIn('scoring_api_request_duration_seconds_bucket{code="200",le="0.1",'
+                      'method="online_score",route="method"} 1', text)
+        self.assertIn('scoring_api_request_duration_seconds_bucket{code="200",le="+Inf",'
+                      'method="online_score",route="method"} 2', text)
+        self.assertIn('scoring_api_stage_duration_seconds_count{method="online_score",'
+                      'route="method",stage="auth"} 1', text)
+
+    def test_metrics_label_escaping(self):
+        metrics = Metrics(buckets=(0.1,))
+        metrics.observe("method", 'a"b\\c\nd', 200, 0.05)
+        self.assertIn('scoring_api_requests_total{code="200",method="a\\"b\\\\c\\nd",route="method"} 1',
+                      metrics.render())
+
+    def test_interests_from_store(self):
+        store = FakeStore({"i:1": '["cars", "pets"]'})
+        self.settings = store
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(["cars", "pets"], response[1])
+        self.assertEqual(1, store.calls)
+
+    def test_store_failure(self):
+        server = start_server(FakeStore(failure_rate=1.0), threaded=False)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(request)
+        score_request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                         "arguments": {"first_name": "a", "last_name": "b"}}
+        self.set_valid_auth(score_request)
+        responses = {}
+        for path, body in [("/method", request), ("/batch", [request, score_request])]:
+            conn = httplib.HTTPConnection(*server.server_address)
+            conn.request("POST", path, json.dumps(body))
+            resp = conn.getresponse()
+            responses[path] = resp.status, json.loads(resp.read())
+            conn.close()
+        self.assertEqual(api.INTERNAL_ERROR, responses["/method"][0])
+        self.assertEqual(api.INTERNAL_ERROR, responses["/method"][1]["code"])
+        # only the item that needs the store fails
+        status, body = responses["/batch"]
+        self.assertEqual(api.OK, status)
+        self.assertEqual([api.INTERNAL_ERROR, api.OK], [r["code"] for r in body["response"]])
+        self.assertEqual(0.5, body["response"][1]["response"]["score"])
+
+    def test_make_request_few_clients(self):
+        rnd = random.Random(0)
+        for _ in xrange(20):
+            request = make_request("clients_interests", rnd, 2)
+            self.assertTrue(set(request["arguments"]["client_ids"]) <= set([0, 1]))
+
 
 if __name__ == "__main__":
     unittest.main()